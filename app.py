@@ -1,60 +1,3056 @@
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, send_file, render_template, Response, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, date, timedelta
+import numpy as np
 import json
+import bisect
+import heapq
+import itertools
+import re
+import tempfile
+import zipfile
 import requests
 import os
+import sys
+import sqlite3
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+import hashlib
+import gzip
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import secrets
+import traceback
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos (só o servidor de desenvolvimento)
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # sem orjson: json da biblioteca padrão (mais lento, mesmo resultado)
+    orjson = None
+
+
+# Serialização JSON (respostas, journal e snapshot)
+def _padrao_json(obj):
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    return DefaultJSONProvider.default(obj)
+
+def json_bytes(obj):
+    """JSON compacto em UTF-8; usa orjson quando instalado.
+
+    O que o orjson recusa (inteiros além de 64 bits, por exemplo) sai pelo
+    json da biblioteca padrão, como antes.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=DefaultJSONProvider.default,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, default=_padrao_json, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+# 19 dígitos seguidos: um inteiro que pode não caber em 64 bits
+_DIGITOS_LONGOS = re.compile(r'\d{19}'), re.compile(rb'\d{19}')
+
+def json_ler(dados):
+    """Lê JSON de str ou bytes; erros de sintaxe são ValueError nos dois casos.
+
+    O orjson lê inteiros além de 64 bits como float e recusa números fora do
+    float (1e400); o que json_bytes gravou pelo json da biblioteca padrão
+    volta por ele, com o mesmo valor.
+    """
+    if orjson is not None and not _DIGITOS_LONGOS[not isinstance(dados, str)].search(dados):
+        try:
+            return orjson.loads(dados)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(dados)
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    """jsonify e app.json com orjson quando instalado (as chaves ficam na ordem do dict)."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return json_ler(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_bytes(obj), mimetype=self.mimetype)
+
 
 app = Flask(__name__)
+app.json = ProvedorJSON(app)
 CORS(app)
 
-# Configurações
-app.config['SECRET_KEY'] = secrets.token_hex(16)
-DATA_FILE = 'dados_producao.json'
-BORDADORES_FILE = 'bordadores.json'
-USERS_FILE = 'usuarios.json'
+# Configurações
+DATA_FILE = 'dados_producao.json'
+BORDADORES_FILE = 'bordadores.json'
+USERS_FILE = 'usuarios.json'
+JOURNAL_FILE = 'dados_producao.journal.jsonl'
+# Lock (fcntl) que serializa as escritas dos workers do gunicorn
+LOCK_FILE = 'dados_producao.lock'
+# Versão dos dados (ETag das rotas GET), compartilhada pelos workers
+VERSION_FILE = 'dados.versao'
+# Respostas GET serializadas guardadas por worker (da versão atual)
+CACHE_RESPOSTAS_MAX = int(os.environ.get('CACHE_RESPOSTAS_MAX', 256))
+# Tamanho do journal (bytes) a partir do qual ele é compactado num snapshot novo
+JOURNAL_LIMITE_BYTES = int(os.environ.get('JOURNAL_LIMITE_BYTES', 1024 * 1024))
+# Armazenamento: 'json' (arquivos + journal) ou 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'producao.db')
+# Processos usados para gerar as planilhas da exportação (1 = no próprio worker)
+EXPORT_PROCESSOS = int(os.environ.get('EXPORT_PROCESSOS', os.cpu_count() or 1))
+# Onde ficam as tarefas de exportação e os ZIPs gerados, e por quanto tempo
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join('exports', 'tarefas'))
+EXPORT_RETENCAO_HORAS = float(os.environ.get('EXPORT_RETENCAO_HORAS', 24))
+EXPORT_MAX_ARQUIVOS = int(os.environ.get('EXPORT_MAX_ARQUIVOS', 20))
+# Uma tarefa em andamento regrava o seu JSON a cada EXPORT_HEARTBEAT_SEGUNDOS;
+# sem isso por EXPORT_TAREFA_EXPIRA_SEGUNDOS, o worker dela morreu
+EXPORT_HEARTBEAT_SEGUNDOS = float(os.environ.get('EXPORT_HEARTBEAT_SEGUNDOS', 15))
+EXPORT_TAREFA_EXPIRA_SEGUNDOS = float(os.environ.get('EXPORT_TAREFA_EXPIRA_SEGUNDOS', 4 * EXPORT_HEARTBEAT_SEGUNDOS))
+# Máximo de registros aceitos por chamada de /api/producao/lote
+LOTE_MAX_REGISTROS = int(os.environ.get('LOTE_MAX_REGISTROS', 1000))
+# Chave que assina os tokens de sessão (a mesma em todos os workers)
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', 'secret_key')
+TOKEN_VALIDADE_HORAS = float(os.environ.get('TOKEN_VALIDADE_HORAS', 12))
+# Verificações de senha (scrypt) simultâneas por worker e quanto um login espera por uma vaga
+LOGIN_SIMULTANEOS = int(os.environ.get('LOGIN_SIMULTANEOS', 2))
+LOGIN_ESPERA_SEGUNDOS = float(os.environ.get('LOGIN_ESPERA_SEGUNDOS', 10))
+# Respostas a partir deste tamanho (bytes) vão com gzip, se o cliente aceitar
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+# nível 1: ~7x menor por uma fração do tempo do nível 6 (ver benchmark_json.py)
+GZIP_NIVEL = int(os.environ.get('GZIP_NIVEL', 1))
+# Threads por worker do gunicorn (o Procfile passa o mesmo WEB_THREADS em --threads)
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+# /api/stream: conexões por worker (cada uma ocupa uma thread do gunicorn; por
+# padrão todas menos SSE_THREADS_LIVRES, que ficam para as outras requisições),
+# intervalo para ver escritas de outros workers e do comentário que mantém a conexão
+SSE_THREADS_LIVRES = int(os.environ.get('SSE_THREADS_LIVRES', 4))
+SSE_MAX_CONEXOES = int(os.environ.get('SSE_MAX_CONEXOES', max(1, WEB_THREADS - SSE_THREADS_LIVRES)))
+SSE_VERIFICAR_SEGUNDOS = float(os.environ.get('SSE_VERIFICAR_SEGUNDOS', 1))
+SSE_HEARTBEAT_SEGUNDOS = float(os.environ.get('SSE_HEARTBEAT_SEGUNDOS', 15))
+SSE_FILA_MAX = int(os.environ.get('SSE_FILA_MAX', 1000))
+# acima do limite: em quantos segundos o EventSource tenta de novo (enquanto isso,
+# o cliente consulta /api/producao/changes nesse mesmo intervalo)
+SSE_REPETIR_SEGUNDOS = int(os.environ.get('SSE_REPETIR_SEGUNDOS', 30))
+# /api/pedidos/sugerir: sugestões devolvidas por padrão e no máximo
+SUGESTOES_PADRAO = int(os.environ.get('SUGESTOES_PADRAO', 10))
+SUGESTOES_MAX = int(os.environ.get('SUGESTOES_MAX', 50))
+# /api/ranking: bordadores devolvidos quando `k` não é informado
+RANKING_PADRAO = int(os.environ.get('RANKING_PADRAO', 10))
+# Arquivo mensal (somente leitura) dos registros exportados e quantas partições cada worker mantém lidas
+ARQUIVO_DIR = os.environ.get('ARQUIVO_DIR', 'arquivo')
+ARQUIVO_CACHE_PARTICOES = int(os.environ.get('ARQUIVO_CACHE_PARTICOES', 12))
+
+def carregar_chave_secreta():
+    """SECRET_KEY do ambiente ou de um arquivo gerado uma única vez e lido por todos os workers."""
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    if not os.path.exists(SECRET_KEY_FILE):
+        temporario = f"{SECRET_KEY_FILE}.{os.getpid()}.tmp"
+        fd = os.open(temporario, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # link não sobrescreve: se dois workers chegarem juntos, vale o primeiro
+            os.link(temporario, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporario)
+    with open(SECRET_KEY_FILE, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+app.config['SECRET_KEY'] = carregar_chave_secreta()
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+# Rotas de Botões 
+
+@app.route('/gerenciamento')
+def gerenciamento():
+    return render_template('gerenciamento.html')  # ou 'gerenciamento.html' se for outro arquivo
+
+@app.route('/pesquisa')
+def pesquisa():
+    return render_template('pesquisa.html')
+
+
+class RegistroCompacto:
+    """Registro de produção guardado em memória em poucos slots.
+
+    As nove marcas ('X' ou '') viram bits de um inteiro (valor e presença),
+    QTD e PONTOS viram int, Data um ordinal e timestamp microssegundos; ID e
+    FOLHA são internados (se repetem entre os registros de um pedido). Um
+    valor que não volta idêntico da forma compacta ('030', '1.500', uma data
+    fora do padrão) e os campos desconhecidos ficam em `outros`, como vieram.
+
+    Funciona como um dict só de leitura (`get`, `[]`, `keys`) para os índices;
+    `como_dict()` devolve o registro no formato JSON de sempre.
+    """
+
+    __slots__ = ('id', 'instante', 'dia', 'bordador', 'pedido', 'folha', 'qtd', 'pontos', 'marcas', 'outros')
+
+    MARCAS = ('BONE', 'CUMBUCA', 'VISEIRA', 'BORDADO', 'AP_PINT', 'AP_GRAV', 'FRENTE', 'LATERAL', 'TRASEIRA')
+    # bit i: marca com 'X'; bit i + PRESENCA: o campo existe ('' ou 'X')
+    PRESENCA = len(MARCAS)
+    CONHECIDOS = frozenset(('id', 'timestamp', 'Data', 'Bordador', 'ID', 'FOLHA', 'QTD', 'PONTOS') + MARCAS)
+    EPOCA = datetime(1970, 1, 1)
+    AUSENTE = object()
+    # caches compartilhados: combinações de marcas, ordinais e textos de data
+    _bits = {}
+    _itens = {}
+    _dias = {}
+    _textos = {}
+
+    @classmethod
+    def de(cls, registro):
+        ausente = cls.AUSENTE
+        get = registro.get
+        r = object.__new__(cls)
+        r.id = registro['id']
+        outros = {}
+        conhecidos = 1
+
+        valores = tuple(get(campo, ausente) for campo in cls.MARCAS)
+        # só combinações de 'X', '' e ausente vão para o cache (e são hasheáveis)
+        simples = all(valor == 'X' or valor == '' or valor is ausente for valor in valores)
+        marcas = cls._bits.get(valores) if simples else None
+        if marcas is None:
+            marcas = 0
+            for i, valor in enumerate(valores):
+                if valor == 'X':
+                    marcas |= 1 << i | 1 << (i + cls.PRESENCA)
+                elif valor == '':
+                    marcas |= 1 << (i + cls.PRESENCA)
+                elif valor is not ausente:
+                    outros[cls.MARCAS[i]] = valor
+            if simples:
+                cls._bits[valores] = marcas
+        r.marcas = marcas
+        conhecidos += len(valores) - valores.count(ausente)
+
+        valor = get('timestamp', ausente)
+        r.instante = ausente
+        if valor is not ausente:
+            conhecidos += 1
+            r.instante = cls._microssegundos(valor)
+            if r.instante is ausente:
+                outros['timestamp'] = valor
+        valor = get('Data', ausente)
+        r.dia = ausente
+        if valor is not ausente:
+            conhecidos += 1
+            r.dia = cls._ordinal(valor)
+            if r.dia is ausente:
+                outros['Data'] = valor
+        r.qtd = r.pontos = ausente
+        for campo in ('QTD', 'PONTOS'):
+            valor = get(campo, ausente)
+            if valor is not ausente:
+                conhecidos += 1
+                numero = cls._inteiro(valor)
+                if numero is ausente:
+                    outros[campo] = valor
+                elif campo == 'QTD':
+                    r.qtd = numero
+                else:
+                    r.pontos = numero
+        r.bordador = get('Bordador', ausente)
+        r.pedido = get('ID', ausente)
+        r.folha = get('FOLHA', ausente)
+        for valor in (r.bordador, r.pedido, r.folha):
+            conhecidos += valor is not ausente
+        if type(r.pedido) is str:
+            r.pedido = sys.intern(r.pedido)
+        if type(r.folha) is str:
+            r.folha = sys.intern(r.folha)
+
+        if len(registro) > conhecidos:
+            outros.update((k, v) for k, v in registro.items() if k not in cls.CONHECIDOS)
+        r.outros = outros or None
+        return r
+
+    @classmethod
+    def _inteiro(cls, valor):
+        """int de um texto que volta idêntico com str(); senão AUSENTE."""
+        if type(valor) is str:
+            try:
+                numero = int(valor)
+            except ValueError:
+                return cls.AUSENTE
+            if str(numero) == valor:
+                return numero
+        return cls.AUSENTE
+
+    @classmethod
+    def _ordinal(cls, valor):
+        dia = cls._dias.get(valor) if type(valor) is str else None
+        if dia is None:
+            try:
+                dia = date.fromisoformat(valor).toordinal()
+            except (TypeError, ValueError):
+                return cls.AUSENTE
+            if date.fromordinal(dia).isoformat() != valor:
+                return cls.AUSENTE
+            cls._dias[valor] = dia
+            cls._textos[dia] = valor
+        return dia
+
+    @classmethod
+    def _microssegundos(cls, valor):
+        try:
+            momento = datetime.fromisoformat(valor)
+        except (TypeError, ValueError):
+            return cls.AUSENTE
+        if momento.tzinfo is not None or momento.isoformat() != valor:
+            return cls.AUSENTE
+        return (momento - cls.EPOCA) // timedelta(microseconds=1)
+
+    @classmethod
+    def _marcas(cls, marcas):
+        """As marcas presentes como dict (campo -> 'X' ou ''), do cache."""
+        itens = cls._itens.get(marcas)
+        if itens is None:
+            itens = cls._itens[marcas] = {
+                campo: 'X' if marcas & 1 << i else ''
+                for i, campo in enumerate(cls.MARCAS) if marcas & 1 << (i + cls.PRESENCA)
+            }
+        return itens
+
+    def como_dict(self):
+        """O registro como dict, no formato gravado e enviado pela API."""
+        ausente = self.AUSENTE
+        registro = {'id': self.id}
+        if self.instante is not ausente:
+            registro['timestamp'] = (self.EPOCA + timedelta(microseconds=self.instante)).isoformat()
+        if self.dia is not ausente:
+            registro['Data'] = self._textos[self.dia]
+        if self.bordador is not ausente:
+            registro['Bordador'] = self.bordador
+        if self.pedido is not ausente:
+            registro['ID'] = self.pedido
+        if self.folha is not ausente:
+            registro['FOLHA'] = self.folha
+        if self.qtd is not ausente:
+            registro['QTD'] = str(self.qtd)
+        if self.marcas:
+            registro.update(self._marcas(self.marcas))
+        if self.pontos is not ausente:
+            registro['PONTOS'] = str(self.pontos)
+        if self.outros is not None:
+            registro.update(self.outros)
+        return registro
+
+    def get(self, campo, padrao=None):
+        if self.outros is not None and campo in self.outros:
+            return self.outros[campo]
+        ausente = self.AUSENTE
+        if campo == 'id':
+            return self.id
+        if campo == 'Data':
+            return padrao if self.dia is ausente else self._textos[self.dia]
+        if campo == 'Bordador':
+            valor = self.bordador
+        elif campo == 'ID':
+            valor = self.pedido
+        elif campo == 'FOLHA':
+            valor = self.folha
+        elif campo == 'QTD':
+            valor = self.qtd if self.qtd is ausente else str(self.qtd)
+        elif campo == 'PONTOS':
+            valor = self.pontos if self.pontos is ausente else str(self.pontos)
+        elif campo == 'timestamp':
+            valor = self.como_dict().get('timestamp', ausente)
+        else:
+            valor = self._marcas(self.marcas).get(campo, ausente)
+        return padrao if valor is ausente else valor
+
+    def __getitem__(self, campo):
+        valor = self.get(campo, self.AUSENTE)
+        if valor is self.AUSENTE:
+            raise KeyError(campo)
+        return valor
+
+    def __contains__(self, campo):
+        return self.get(campo, self.AUSENTE) is not self.AUSENTE
+
+    def keys(self):
+        return self.como_dict().keys()
+
+    def __eq__(self, outro):
+        if isinstance(outro, RegistroCompacto):
+            return all(getattr(self, nome) == getattr(outro, nome) for nome in self.__slots__)
+        if isinstance(outro, dict):
+            return self.como_dict() == outro
+        return NotImplemented
+
+    __hash__ = None
+
+
+# Armazenamento dos registros de produção
+class IndiceDataBordador:
+    """Índices secundários por data e por bordador.
+
+    Mantém a lista de (Data, id) ordenada, global e por bordador, para que um
+    filtro de período seja resolvido com bisect em O(log N + k) em vez de
+    comparar a data de todos os registros. Também mantém os ids ordenados,
+    global e por bordador, usados pela paginação por cursor.
+
+    Os ids de um período saem da lista em ordem de data; ordenados por id,
+    ficam guardados (os últimos PERIODOS_EM_CACHE filtros) até a próxima
+    mudança, e as páginas seguintes do mesmo filtro são só um bisect.
+    """
+
+    PERIODOS_EM_CACHE = 16
+
+    def __init__(self):
+        self._periodos = OrderedDict()
+        self.reconstruir([])
+
+    @staticmethod
+    def _chave(registro):
+        return (str(registro.get('Data') or ''), registro['id'])
+
+    def reconstruir(self, registros):
+        self._periodos.clear()
+        self._por_data = sorted(self._chave(r) for r in registros)
+        self._ids = sorted(r['id'] for r in registros)
+        self._por_bordador = {}
+        self._ids_por_bordador = {}
+        for registro in registros:
+            self._por_bordador.setdefault(registro.get('Bordador'), []).append(self._chave(registro))
+            self._ids_por_bordador.setdefault(registro.get('Bordador'), []).append(registro['id'])
+        for lista in (*self._por_bordador.values(), *self._ids_por_bordador.values()):
+            lista.sort()
+
+    @staticmethod
+    def _retirar(lista, valor):
+        i = bisect.bisect_left(lista, valor)
+        if i < len(lista) and lista[i] == valor:
+            del lista[i]
+
+    def adicionar(self, registro):
+        self._periodos.clear()
+        chave, bordador = self._chave(registro), registro.get('Bordador')
+        bisect.insort(self._por_data, chave)
+        bisect.insort(self._ids, registro['id'])
+        bisect.insort(self._por_bordador.setdefault(bordador, []), chave)
+        bisect.insort(self._ids_por_bordador.setdefault(bordador, []), registro['id'])
+
+    def adicionar_varios(self, registros):
+        self._periodos.clear()
+        # uma ordenação por lista: o timsort junta as duas partes já ordenadas
+        self._por_data = sorted(self._por_data + [self._chave(r) for r in registros])
+        self._ids = sorted(self._ids + [r['id'] for r in registros])
+        por_bordador, ids_por_bordador = {}, {}
+        for registro in registros:
+            por_bordador.setdefault(registro.get('Bordador'), []).append(self._chave(registro))
+            ids_por_bordador.setdefault(registro.get('Bordador'), []).append(registro['id'])
+        for tabela, novos in ((self._por_bordador, por_bordador), (self._ids_por_bordador, ids_por_bordador)):
+            for bordador, lista in novos.items():
+                tabela[bordador] = sorted(tabela.get(bordador, []) + lista)
+
+    def remover(self, registro):
+        self._periodos.clear()
+        chave, bordador = self._chave(registro), registro.get('Bordador')
+        self._retirar(self._por_data, chave)
+        self._retirar(self._ids, registro['id'])
+        if bordador in self._por_bordador:
+            self._retirar(self._por_bordador[bordador], chave)
+            self._retirar(self._ids_por_bordador[bordador], registro['id'])
+            if not self._por_bordador[bordador]:
+                del self._por_bordador[bordador], self._ids_por_bordador[bordador]
+
+    def renomear_bordador(self, antigo, novo):
+        if antigo == novo or antigo not in self._por_bordador:
+            return
+        self._periodos.clear()
+        for tabela in (self._por_bordador, self._ids_por_bordador):
+            tabela[novo] = sorted(tabela.get(novo, []) + tabela.pop(antigo))
+
+    def ids(self, bordador=None, data_inicio=None, data_fim=None):
+        """Ids (em ordem crescente) do bordador e/ou do período."""
+        if not (data_inicio and data_fim):
+            return list(self._ids_por_bordador.get(bordador, []) if bordador else self._ids)
+        return list(self._ids_do_periodo(bordador, data_inicio, data_fim))
+
+    def _ids_do_periodo(self, bordador, data_inicio, data_fim):
+        """Ids do período ordenados por id, do cache enquanto o índice não mudar (não alterar)."""
+        chave = (bordador, data_inicio, data_fim)
+        ids = self._periodos.get(chave)
+        if ids is not None:
+            self._periodos.move_to_end(chave)
+            return ids
+        lista = self._por_bordador.get(bordador, []) if bordador else self._por_data
+        inicio = bisect.bisect_left(lista, (data_inicio,))
+        fim = bisect.bisect_right(lista, (data_fim, float('inf')))
+        ids = self._periodos[chave] = sorted(rid for _, rid in lista[inicio:fim])
+        while len(self._periodos) > self.PERIODOS_EM_CACHE:
+            self._periodos.popitem(last=False)
+        return ids
+
+    def pagina(self, bordador=None, data_inicio=None, data_fim=None, apos=None, limite=None):
+        """(ids da página, total, próximo cursor) em ordem de id, depois do id `apos`.
+
+        Com período, a primeira página ordena os ids do período; as seguintes
+        (sem mudanças no meio) custam O(log N + limite).
+        """
+        if data_inicio and data_fim:
+            ids = self._ids_do_periodo(bordador, data_inicio, data_fim)
+        else:
+            # sem período, a página sai direto da lista ordenada: O(log N + limite)
+            ids = self._ids_por_bordador.get(bordador, []) if bordador else self._ids
+        inicio = bisect.bisect_right(ids, apos) if apos is not None else 0
+        fim = len(ids) if limite is None else min(inicio + limite, len(ids))
+        proximo = ids[fim - 1] if fim < len(ids) and fim > inicio else None
+        return ids[inicio:fim], len(ids), proximo
+
+
+NUMERO_MAXIMO = np.iinfo(np.int64).max
+
+def numero_inteiro(valor):
+    """Converte QTD/PONTOS ('1.500', '30 pçs', ...) em inteiro; 0 se não houver dígitos.
+
+    Limitado a 64 bits, como nas colunas NumPy: os agregados e as respostas
+    não recebem números que não cabem num int64.
+    """
+    try:
+        return min(int(''.join(filter(str.isdigit, str(valor)))), NUMERO_MAXIMO)
+    except ValueError:
+        return 0
+
+def data_ordinal(valor):
+    """Data 'AAAA-MM-DD' como ordinal (dias); ValueError se inválida."""
+    return date.fromisoformat(str(valor)[:10]).toordinal()
+
+
+class ColunasNumericas:
+    """Colunas NumPy paralelas aos registros, com os campos numéricos já convertidos.
+
+    QTD e PONTOS são convertidos uma única vez, quando o registro é gravado
+    ou carregado; a data vira ordinal e o bordador um código inteiro. Cada
+    registro ocupa um slot; slots de registros excluídos são marcados como
+    inativos e reaproveitados. Os totais saem de máscaras e somas vetorizadas.
+
+    Cada marca (tipo, processo e posição) tem o seu bitmap em `marcas`, uma
+    linha booleana por campo: filtrar por várias marcas é um AND de linhas.
+    """
+
+    MARCAS = RegistroCompacto.MARCAS
+
+    def __init__(self):
+        self._slot_por_id = {}
+        self._livres = []
+        self._codigos = {}
+        self._proximo_codigo = 0
+        self._alocar(0)
+
+    def _alocar(self, capacidade):
+        self.n = 0
+        self.id = np.zeros(capacidade, np.int64)
+        self.qtd = np.zeros(capacidade, np.int64)
+        self.pontos = np.zeros(capacidade, np.int64)
+        self.data = np.full(capacidade, -1, np.int64)
+        self.bordador = np.full(capacidade, -1, np.int32)
+        self.ativo = np.zeros(capacidade, bool)
+        self.marcas = np.zeros((len(self.MARCAS), capacidade), bool)
+
+    def _codigo(self, bordador):
+        codigo = self._codigos.get(bordador)
+        if codigo is None:
+            # não reaproveita códigos: depois de uma mescla, len() pode repetir um em uso
+            codigo = self._codigos[bordador] = self._proximo_codigo
+            self._proximo_codigo += 1
+        return codigo
+
+    def _valores(self, registro):
+        try:
+            ordinal = data_ordinal(registro.get('Data'))
+        except ValueError:
+            ordinal = -1
+        return (registro['id'],
+                numero_inteiro(registro.get('QTD', '0')),
+                numero_inteiro(registro.get('PONTOS', '0')),
+                ordinal,
+                self._codigo(registro.get('Bordador')),
+                sum(1 << i for i, campo in enumerate(self.MARCAS) if registro.get(campo) == 'X'))
+
+    def _marcar(self, inicio, bits):
+        """Espalha as marcas (um inteiro por registro, bit i = MARCAS[i]) nos bitmaps."""
+        bits = np.asarray(bits, np.int64)
+        self.marcas[:, inicio:inicio + len(bits)] = (bits >> np.arange(len(self.MARCAS))[:, None]) & 1
+
+    def _preencher(self, slot, registro):
+        (self.id[slot], self.qtd[slot], self.pontos[slot],
+         self.data[slot], self.bordador[slot], bits) = self._valores(registro)
+        self._marcar(slot, [bits])
+        self.ativo[slot] = True
+        self._slot_por_id[registro['id']] = slot
+
+    def reconstruir(self, registros):
+        self._slot_por_id = {}
+        self._livres = []
+        self._codigos = {}
+        self._proximo_codigo = 0
+        self._alocar(max(16, len(registros) * 2))
+        if registros:
+            colunas = list(zip(*map(self._valores, registros)))
+            n = len(registros)
+            self.id[:n], self.qtd[:n], self.pontos[:n], self.data[:n], self.bordador[:n] = colunas[:5]
+            self._marcar(0, colunas[5])
+            self.ativo[:n] = True
+            self._slot_por_id = {rid: slot for slot, rid in enumerate(colunas[0])}
+        self.n = len(registros)
+
+    def _crescer(self, minimo):
+        capacidade = len(self.id)
+        if minimo <= capacidade:
+            return
+        while capacidade < minimo:
+            capacidade = max(16, capacidade * 2)
+        for nome in ('id', 'qtd', 'pontos', 'data', 'bordador', 'ativo', 'marcas'):
+            coluna = getattr(self, nome)
+            nova = np.zeros(coluna.shape[:-1] + (capacidade,), coluna.dtype)
+            nova[..., :self.n] = coluna[..., :self.n]
+            setattr(self, nome, nova)
+
+    def adicionar(self, registro):
+        if self._livres:
+            slot = self._livres.pop()
+        else:
+            self._crescer(self.n + 1)
+            slot = self.n
+            self.n += 1
+        self._preencher(slot, registro)
+
+    def adicionar_varios(self, registros):
+        """Ocupa os slots livres e depois grava o restante como um bloco no fim."""
+        registros = list(registros)
+        while registros and self._livres:
+            self._preencher(self._livres.pop(), registros.pop())
+        if not registros:
+            return
+        inicio, fim = self.n, self.n + len(registros)
+        self._crescer(fim)
+        colunas = list(zip(*map(self._valores, registros)))
+        (self.id[inicio:fim], self.qtd[inicio:fim], self.pontos[inicio:fim],
+         self.data[inicio:fim], self.bordador[inicio:fim]) = colunas[:5]
+        self._marcar(inicio, colunas[5])
+        self.ativo[inicio:fim] = True
+        self._slot_por_id.update(zip(colunas[0], range(inicio, fim)))
+        self.n = fim
+
+    def remover(self, registro):
+        slot = self._slot_por_id.pop(registro['id'], None)
+        if slot is not None:
+            self.ativo[slot] = False
+            self._livres.append(slot)
+
+    def renomear_bordador(self, antigo, novo):
+        codigo = self._codigos.pop(antigo, None)
+        if codigo is None:
+            return
+        if novo in self._codigos:
+            coluna = self.bordador[:self.n]
+            coluna[coluna == codigo] = self._codigos[novo]
+        else:
+            self._codigos[novo] = codigo
+
+    def numeros(self, id):
+        """(qtd, pontos) já convertidos do registro."""
+        slot = self._slot_por_id.get(id)
+        if slot is None:
+            return 0, 0
+        return int(self.qtd[slot]), int(self.pontos[slot])
+
+    def mascara(self, bordador=None, data_inicio=None, data_fim=None):
+        """Máscara booleana (sobre os slots ocupados) do bordador e/ou período."""
+        mascara = self.ativo[:self.n].copy()
+        if bordador:
+            codigo = self._codigos.get(bordador)
+            if codigo is None:
+                return np.zeros(self.n, bool)
+            mascara &= self.bordador[:self.n] == codigo
+        if data_inicio and data_fim:
+            datas = self.data[:self.n]
+            mascara &= (datas >= data_ordinal(data_inicio)) & (datas <= data_ordinal(data_fim))
+        return mascara
+
+    def mascara_ids(self, ids):
+        """Máscara dos slots dos ids (os que não estão nas colunas ficam de fora)."""
+        mascara = np.zeros(self.n, bool)
+        mascara[[self._slot_por_id[i] for i in ids if i in self._slot_por_id]] = True
+        return mascara
+
+    def filtrar_marcas(self, mascara, com=(), sem=()):
+        """A máscara só com os slots que têm todas as marcas `com` e nenhuma de `sem`."""
+        for campo in com:
+            mascara &= self.marcas[self.MARCAS.index(campo), :self.n]
+        for campo in sem:
+            mascara &= ~self.marcas[self.MARCAS.index(campo), :self.n]
+        return mascara
+
+    def contar_marcas(self, mascara):
+        """Quantos slots da máscara têm cada marca."""
+        contagens = np.count_nonzero(self.marcas[:, :self.n] & mascara, axis=1)
+        return dict(zip(self.MARCAS, contagens.tolist()))
+
+    def ids_da_mascara(self, mascara):
+        """Ids dos slots da máscara, em ordem."""
+        return np.sort(self.id[:self.n][mascara])
+
+    def totais(self, mascara):
+        return {
+            'total_registros': int(np.count_nonzero(mascara)),
+            'total_pecas': int(self.qtd[:self.n][mascara].sum()),
+            'total_pontos': int(self.pontos[:self.n][mascara].sum())
+        }
+
+    # ordinal de 1970-01-01, a época do datetime64
+    EPOCA = date(1970, 1, 1).toordinal()
+
+    @classmethod
+    def periodos(cls, datas, granularidade):
+        """Ordinal do primeiro dia do período de cada data (ordinal): ela mesma,
+        a segunda-feira da semana ou o dia 1 do mês."""
+        if granularidade == 'semana':
+            # o ordinal 1 (0001-01-01) é uma segunda-feira
+            return datas - (datas - 1) % 7
+        if granularidade == 'mes':
+            meses = (datas - cls.EPOCA).astype('datetime64[D]').astype('datetime64[M]')
+            return meses.astype('datetime64[D]').astype(np.int64) + cls.EPOCA
+        return datas
+
+    def serie(self, mascara, granularidade):
+        """Registros, peças e pontos somados por (período, bordador) nos slots da máscara.
+
+        O período é o ordinal do seu primeiro dia: o próprio dia, a segunda-feira
+        da semana ou o dia 1 do mês. Retorna arrays (período, bordador,
+        registros, peças, pontos), um elemento por grupo, em ordem de período.
+        Ordena as chaves uma vez e soma cada grupo com `np.add.reduceat`.
+        """
+        mascara = mascara & (self.data[:self.n] >= 0)
+        periodos = self.periodos(self.data[:self.n][mascara], granularidade)
+        base = max(self._proximo_codigo, 1)
+        chaves = periodos * base + self.bordador[:self.n][mascara]
+        ordem = np.argsort(chaves)
+        chaves = chaves[ordem]
+        inicios = np.flatnonzero(np.concatenate(([True], chaves[1:] != chaves[:-1]))) if len(chaves) else np.zeros(0, np.int64)
+        bordadores = np.empty(base, object)
+        for bordador, codigo in self._codigos.items():
+            bordadores[codigo] = bordador
+        grupos = chaves[inicios]
+        if not len(grupos):
+            vazio = np.zeros(0, np.int64)
+            return vazio, np.empty(0, object), vazio, vazio, vazio
+        return (grupos // base,
+                bordadores[grupos % base],
+                np.diff(np.append(inicios, len(chaves))),
+                np.add.reduceat(self.qtd[:self.n][mascara][ordem], inicios),
+                np.add.reduceat(self.pontos[:self.n][mascara][ordem], inicios))
+
+
+class AgregadosDiarios:
+    """Totais (registros, peças, pontos) mantidos por (bordador, Data).
+
+    Cada operação soma ou subtrai a contribuição de um registro em O(1) (mais
+    a inserção ordenada quando aparece um dia novo). As estatísticas gerais,
+    por bordador e por período saem destas tabelas, sem percorrer registros:
+    um período custa O(log D + dias no intervalo).
+    """
+
+    def __init__(self):
+        self.reconstruir([])
+
+    def reconstruir(self, registros):
+        self._total = [0, 0, 0]
+        self._por_bordador = {}
+        self._celulas = {}
+        self._por_dia = {}
+        self._dias = []
+        self._dias_por_bordador = {}
+        for registro in registros:
+            self.adicionar(registro)
+
+    @staticmethod
+    def _acumular(tabela, chave, delta):
+        """Soma delta em tabela[chave]; True se a chave foi criada ou removida."""
+        atual = tabela.get(chave)
+        criada = atual is None
+        if criada:
+            atual = tabela[chave] = [0, 0, 0]
+        for i, valor in enumerate(delta):
+            atual[i] += valor
+        if atual[0] == 0:
+            del tabela[chave]
+            return True
+        return criada
+
+    @staticmethod
+    def _marcar_dia(dias, dia, presente):
+        i = bisect.bisect_left(dias, dia)
+        if presente:
+            dias.insert(i, dia)
+        elif i < len(dias) and dias[i] == dia:
+            del dias[i]
+
+    def _somar(self, bordador, dia, delta):
+        for i, valor in enumerate(delta):
+            self._total[i] += valor
+        self._acumular(self._por_bordador, bordador, delta)
+        if self._acumular(self._celulas, (bordador, dia), delta) and dia:
+            self._marcar_dia(self._dias_por_bordador.setdefault(bordador, []), dia, (bordador, dia) in self._celulas)
+        if self._acumular(self._por_dia, dia, delta) and dia:
+            self._marcar_dia(self._dias, dia, dia in self._por_dia)
+
+    @staticmethod
+    def _contribuicao(registro, sinal):
+        return (sinal,
+                sinal * numero_inteiro(registro.get('QTD', '0')),
+                sinal * numero_inteiro(registro.get('PONTOS', '0')))
+
+    def adicionar(self, registro):
+        self._somar(registro.get('Bordador'), str(registro.get('Data') or ''), self._contribuicao(registro, 1))
+
+    def adicionar_varios(self, registros):
+        for registro in registros:
+            self.adicionar(registro)
+
+    def remover(self, registro):
+        self._somar(registro.get('Bordador'), str(registro.get('Data') or ''), self._contribuicao(registro, -1))
+
+    def renomear_bordador(self, antigo, novo):
+        if antigo == novo or antigo not in self._por_bordador:
+            return
+        self._acumular(self._por_bordador, novo, self._por_bordador.pop(antigo))
+        dias = self._dias_por_bordador.pop(antigo, [])
+        for dia in dias + ([''] if (antigo, '') in self._celulas else []):
+            if self._acumular(self._celulas, (novo, dia), self._celulas.pop((antigo, dia))) and dia:
+                self._marcar_dia(self._dias_por_bordador.setdefault(novo, []), dia, True)
+
+    def totais(self, bordador=None, data_inicio=None, data_fim=None):
+        if data_inicio and data_fim:
+            if bordador:
+                dias = self._dias_por_bordador.get(bordador, [])
+                celulas = [(bordador, d) for d in dias[bisect.bisect_left(dias, data_inicio):bisect.bisect_right(dias, data_fim)]]
+                tabela = self._celulas
+            else:
+                celulas = self._dias[bisect.bisect_left(self._dias, data_inicio):bisect.bisect_right(self._dias, data_fim)]
+                tabela = self._por_dia
+            soma = [sum(tabela[c][i] for c in celulas) for i in range(3)]
+        elif bordador:
+            soma = self._por_bordador.get(bordador, [0, 0, 0])
+        else:
+            soma = self._total
+        return {
+            'total_registros': soma[0],
+            'total_pecas': soma[1],
+            'total_pontos': soma[2]
+        }
+
+    def ranking(self, k, campo, data_inicio=None, data_fim=None, nome=str):
+        """Os k bordadores com maior total no campo (0 registros, 1 peças, 2 pontos).
+
+        Cada bordador soma só as suas células no período (bisect nos seus dias)
+        e o heap escolhe os k: O(B·log D + dias no período + B·log k), sem
+        depender da quantidade de registros. Retorna [(bordador, [registros, peças, pontos])].
+        """
+        return self.melhores(k, campo, self.por_bordador(data_inicio, data_fim), nome)
+
+    @staticmethod
+    def melhores(k, campo, totais, nome=str):
+        """Os k maiores de [(bordador, [registros, peças, pontos])] no campo; empates
+        em ordem de `nome(bordador)`, para não depender da ordem dos dicionários."""
+        return heapq.nsmallest(k, totais, key=lambda item: (-item[1][campo], str(nome(item[0]))))
+
+    def por_bordador(self, data_inicio=None, data_fim=None):
+        """[(bordador, [registros, peças, pontos])] de cada bordador com produção no período."""
+        if not (data_inicio and data_fim):
+            return list(self._por_bordador.items())
+        totais = []
+        for bordador, dias in self._dias_por_bordador.items():
+            celulas = dias[bisect.bisect_left(dias, data_inicio):bisect.bisect_right(dias, data_fim)]
+            if celulas:
+                totais.append((bordador, [sum(self._celulas[(bordador, d)][i] for d in celulas) for i in range(3)]))
+        return totais
+
+    def celulas(self, bordador=None, data_inicio=None, data_fim=None):
+        """[(bordador, Data, [registros, peças, pontos])] por dia com produção, no período se houver."""
+        encontradas = []
+        for nome, dias in self._dias_por_bordador.items():
+            if bordador and nome != bordador:
+                continue
+            if data_inicio and data_fim:
+                dias = dias[bisect.bisect_left(dias, data_inicio):bisect.bisect_right(dias, data_fim)]
+            encontradas.extend((nome, dia, self._celulas[(nome, dia)]) for dia in dias)
+        return encontradas
+
+    def todas_celulas(self):
+        """[(bordador, Data, [registros, peças, pontos])] de todas as células, inclusive sem data."""
+        return [(bordador, dia, soma) for (bordador, dia), soma in self._celulas.items()]
+
+    def adicionar_celulas(self, celulas):
+        """Soma células (bordador, Data, [registros, peças, pontos]) já agregadas."""
+        for bordador, dia, soma in celulas:
+            self._somar(bordador, dia, soma)
+
+    def igual(self, outro):
+        return self._celulas == outro._celulas and self._total == outro._total
+
+
+class ResumoPedidos:
+    """Resumo de cada pedido (campo ID) para /api/buscar-pedido, mantido a cada operação.
+
+    Por pedido ficam os ids dos registros (em ordem), os ids com cada posição
+    marcada, os totais e, por bordador, ids, peças, pontos e posições. Tipos e
+    processos contam registros por bordador: a pertença é uma chave de
+    dicionário e excluir um registro só decrementa. Buscar um pedido não
+    percorre os outros; renomear (mesclar) um bordador percorre os pedidos.
+
+    A resposta segue a ordem dos ids, como a varredura antiga. Inserções novas
+    chegam em ordem; depois de editar, excluir ou renomear, o pedido é marcado
+    e refeito a partir dos seus registros na próxima busca.
+    """
+
+    POSICOES = {'FRENTE': 'Frente', 'LATERAL': 'Lateral', 'TRASEIRA': 'Traseira'}
+    TIPOS = ('BONE', 'CUMBUCA', 'VISEIRA')
+    PROCESSOS = ('BORDADO', 'AP_PINT', 'AP_GRAV')
+
+    def __init__(self):
+        self.pedidos = {}
+
+    def reconstruir(self, registros):
+        self.pedidos = {}
+        self.adicionar_varios(registros)
+
+    @staticmethod
+    def _contar(tabela, chave, delta):
+        total = tabela.get(chave, 0) + delta
+        if total:
+            tabela[chave] = total
+        else:
+            tabela.pop(chave, None)
+
+    def _somar(self, registro, sinal):
+        # a busca chega como texto na URL; ID numérico (ou estranho) vira texto
+        chave = registro.get('ID')
+        chave = None if chave is None else str(chave)
+        pedido = self.pedidos.get(chave)
+        if pedido is None:
+            if sinal < 0:
+                return
+            pedido = self.pedidos[chave] = {
+                'ids': {}, 'ultimo': 0, 'reordenar': False, 'pecas': 0, 'pontos': 0, 'bordadores': {},
+                'posicoes': {campo: {} for campo in self.POSICOES},
+                'marcas': {campo: {} for campo in self.TIPOS + self.PROCESSOS}
+            }
+        rid = registro['id']
+        if sinal < 0 or rid <= pedido['ultimo']:
+            pedido['reordenar'] = True
+        pedido['ultimo'] = max(pedido['ultimo'], rid)
+        bordador = registro.get('Bordador', 'Desconhecido')
+        qtd = sinal * numero_inteiro(registro.get('QTD', '0'))
+        pontos = sinal * numero_inteiro(registro.get('PONTOS', '0'))
+        resumo = pedido['bordadores'].get(bordador)
+        if resumo is None:
+            resumo = pedido['bordadores'][bordador] = {'ids': {}, 'pecas': 0, 'pontos': 0, 'posicoes': {}}
+        for ids in [pedido['ids'], resumo['ids']] + [pedido['posicoes'][c] for c in self.POSICOES if registro.get(c) == 'X']:
+            if sinal > 0:
+                ids[rid] = None
+            else:
+                ids.pop(rid, None)
+        pedido['pecas'] += qtd
+        pedido['pontos'] += pontos
+        resumo['pecas'] += qtd
+        resumo['pontos'] += pontos
+        for campo, nome in self.POSICOES.items():
+            if registro.get(campo) == 'X':
+                self._contar(resumo['posicoes'], nome, sinal)
+        for campo, contagem in pedido['marcas'].items():
+            if registro.get(campo) == 'X':
+                self._contar(contagem, bordador, sinal)
+        if not resumo['ids']:
+            del pedido['bordadores'][bordador]
+        if not pedido['ids']:
+            del self.pedidos[chave]
+
+    def adicionar(self, registro):
+        self._somar(registro, 1)
+
+    def adicionar_varios(self, registros):
+        for registro in registros:
+            self._somar(registro, 1)
+
+    def remover(self, registro):
+        self._somar(registro, -1)
+
+    def renomear_bordador(self, antigo, novo):
+        if antigo == novo:
+            return
+        for pedido in self.pedidos.values():
+            resumo = pedido['bordadores'].pop(antigo, None)
+            if resumo is None:
+                continue
+            pedido['reordenar'] = True
+            destino = pedido['bordadores'].get(novo)
+            if destino is None:
+                pedido['bordadores'][novo] = resumo
+            else:
+                destino['ids'].update(resumo['ids'])
+                destino['pecas'] += resumo['pecas']
+                destino['pontos'] += resumo['pontos']
+                for nome, quantos in resumo['posicoes'].items():
+                    self._contar(destino['posicoes'], nome, quantos)
+            for contagem in pedido['marcas'].values():
+                quantos = contagem.pop(antigo, 0)
+                if quantos:
+                    self._contar(contagem, novo, quantos)
+
+    def resultado(self, chave, por_id, nome_bordador):
+        """O resumo no formato de /api/buscar-pedido, ou None se o pedido não existe."""
+        pedido = self.pedidos.get(chave)
+        if pedido is None:
+            return None
+        if pedido['reordenar']:
+            del self.pedidos[chave]
+            self.adicionar_varios(por_id[rid] for rid in sorted(pedido['ids']))
+            pedido = self.pedidos[chave]
+        bordadores = {}
+        for codigo, resumo in pedido['bordadores'].items():
+            bordadores[nome_bordador(codigo)] = {
+                'registros': len(resumo['ids']),
+                'pecas': resumo['pecas'],
+                'pontos': resumo['pontos'],
+                'posicoes': list(resumo['posicoes']),
+                'data': por_id[next(iter(resumo['ids']))].get('Data', '')
+            }
+        posicoes = {}
+        for campo, ids in pedido['posicoes'].items():
+            posicoes[campo] = [{
+                'bordador': nome_bordador(por_id[rid].get('Bordador', 'Desconhecido')),
+                'qtd': por_id[rid].get('QTD', '0'),
+                'pontos': por_id[rid].get('PONTOS', '0'),
+                'data': por_id[rid].get('Data', ''),
+                'bordado': por_id[rid].get('BORDADO', '') == 'X'
+            } for rid in ids]
+        marcas = {campo: [{'bordador': nome_bordador(c)} for c in contagem]
+                  for campo, contagem in pedido['marcas'].items()}
+        return {
+            'id_pedido': chave,
+            'total_registros': len(pedido['ids']),
+            'bordadores': bordadores,
+            'posicoes': posicoes,
+            'tipos': {campo: marcas[campo] for campo in self.TIPOS},
+            'processos': {campo: marcas[campo] for campo in self.PROCESSOS},
+            'resumo': {
+                'total_pecas': pedido['pecas'],
+                'total_pontos': pedido['pontos']
+            }
+        }
+
+
+class PrefixosPedidos:
+    """Valores de ID (pedido) e FOLHA ordenados, para sugerir pedidos pelo começo.
+
+    Cada campo tem uma lista ordenada de chaves distintas (o texto em
+    minúsculas, o valor e o pedido) e quantos registros cada chave tem. A
+    busca por prefixo é um bisect até a primeira chave que não começa com o
+    texto: O(log N + limite), sem percorrer os registros. Uma chave entra na
+    lista no primeiro registro e sai quando o último é excluído.
+    """
+
+    CAMPOS = ('ID', 'FOLHA')
+
+    def __init__(self):
+        self.reconstruir([])
+
+    @staticmethod
+    def _chaves(registro):
+        pedido = str(registro.get('ID') or '')
+        if not pedido.strip():
+            return []
+        chaves = [('ID', (pedido.strip().casefold(), pedido, pedido))]
+        folha = str(registro.get('FOLHA') or '').strip()
+        if folha:
+            chaves.append(('FOLHA', (folha.casefold(), folha, pedido)))
+        return chaves
+
+    def reconstruir(self, registros):
+        self._ordenadas = {campo: [] for campo in self.CAMPOS}
+        self._contagem = {campo: {} for campo in self.CAMPOS}
+        self.adicionar_varios(registros)
+
+    def adicionar(self, registro):
+        for campo, chave in self._chaves(registro):
+            contagem = self._contagem[campo]
+            contagem[chave] = contagem.get(chave, 0) + 1
+            if contagem[chave] == 1:
+                bisect.insort(self._ordenadas[campo], chave)
+
+    def adicionar_varios(self, registros):
+        self.somar((registro, 1) for registro in registros)
+
+    def somar(self, contagens):
+        """Soma pares (registro, quantos registros iguais a ele no ID e na FOLHA); uma ordenação por campo no fim."""
+        novas = {campo: [] for campo in self.CAMPOS}
+        for registro, quantos in contagens:
+            for campo, chave in self._chaves(registro):
+                contagem = self._contagem[campo]
+                anterior = contagem.get(chave, 0)
+                contagem[chave] = anterior + quantos
+                if not anterior:
+                    novas[campo].append(chave)
+        for campo, lista in novas.items():
+            if lista:
+                self._ordenadas[campo] = sorted(self._ordenadas[campo] + lista)
+
+    def remover(self, registro):
+        for campo, chave in self._chaves(registro):
+            contagem = self._contagem[campo]
+            if chave not in contagem:
+                continue
+            contagem[chave] -= 1
+            if not contagem[chave]:
+                del contagem[chave]
+                IndiceDataBordador._retirar(self._ordenadas[campo], chave)
+
+    def renomear_bordador(self, antigo, novo):
+        pass
+
+    def _candidatas(self, campo, prefixo):
+        """(chave, registros) do campo cujas chaves começam com `prefixo`, em ordem."""
+        ordenadas, contagem = self._ordenadas[campo], self._contagem[campo]
+        i = bisect.bisect_left(ordenadas, (prefixo,))
+        while i < len(ordenadas) and ordenadas[i][0].startswith(prefixo):
+            yield ordenadas[i], contagem[ordenadas[i]]
+            i += 1
+
+    def sugerir(self, texto, limite, outros=()):
+        """Até `limite` pedidos cujo ID começa com `texto`, depois os pela FOLHA.
+
+        Cada sugestão traz o pedido e quantos registros ele tem (na FOLHA, os
+        registros daquela folha), em ordem alfabética. As chaves de `outros`
+        (o índice do histórico arquivado) entram na mesma ordem, com as
+        contagens das chaves iguais somadas.
+        """
+        prefixo = texto.strip().casefold()
+        sugestoes = []
+        if not prefixo:
+            return sugestoes
+        for campo in self.CAMPOS:
+            candidatas = heapq.merge(*(indice._candidatas(campo, prefixo) for indice in (self, *outros)),
+                                     key=lambda candidata: candidata[0])
+            for chave, iguais in itertools.groupby(candidatas, key=lambda candidata: candidata[0]):
+                if len(sugestoes) >= limite:
+                    break
+                sugestao = {'pedido': chave[2], 'registros': sum(quantos for _, quantos in iguais)}
+                if campo == 'FOLHA':
+                    sugestao['folha'] = chave[1]
+                sugestoes.append(sugestao)
+        return sugestoes
+
+
+class TabelaBordadores:
+    """Dicionário dos nomes de bordador referenciados pelos registros.
+
+    Os registros guardam em 'Bordador' um id inteiro estável (a partir de 1);
+    o nome fica só aqui, então renomear altera uma única entrada. Como índice,
+    conta quantos registros referenciam cada id, o que torna O(1) a checagem
+    antes de excluir um bordador.
+    """
+
+    def __init__(self):
+        self.nomes = {}
+        self.ids = {}
+        self.referencias = {}
+
+    def carregar(self, nomes):
+        self.nomes = dict(nomes)
+        self.ids = {nome: codigo for codigo, nome in self.nomes.items()}
+
+    def definir(self, codigo, nome):
+        anterior = self.nomes.get(codigo)
+        if self.ids.get(anterior) == codigo:
+            del self.ids[anterior]
+        self.nomes[codigo] = nome
+        self.ids[nome] = codigo
+
+    def descartar(self, codigo):
+        nome = self.nomes.pop(codigo, None)
+        if self.ids.get(nome) == codigo:
+            del self.ids[nome]
+
+    def proximo_id(self):
+        return max(self.nomes, default=0) + 1
+
+    def reconstruir(self, registros):
+        self.referencias = {}
+        self.adicionar_varios(registros)
+
+    def adicionar(self, registro):
+        codigo = registro.get('Bordador')
+        if codigo is not None:
+            self.referencias[codigo] = self.referencias.get(codigo, 0) + 1
+
+    def adicionar_varios(self, registros):
+        for registro in registros:
+            self.adicionar(registro)
+
+    def remover(self, registro):
+        codigo = registro.get('Bordador')
+        if codigo in self.referencias:
+            self.referencias[codigo] -= 1
+            if not self.referencias[codigo]:
+                del self.referencias[codigo]
+
+    def renomear_bordador(self, antigo, novo):
+        if antigo != novo and antigo in self.referencias:
+            self.referencias[novo] = self.referencias.get(novo, 0) + self.referencias.pop(antigo)
+
+
+class ArmazemProducao:
+    """Cache em memória dos registros de produção.
+
+    Os registros ficam num dicionário id -> registro, que preserva a ordem de
+    inserção, então buscar, alterar e excluir por id não percorrem a lista.
+    Os índices em `self._indices` (reconstruir/adicionar/adicionar_varios/
+    remover/renomear_bordador) são mantidos a cada operação aplicada.
+    Toda escrita é uma operação insert/update/delete/lote que a subclasse persiste;
+    o que outros workers gravaram é reaplicado em `sincronizar()`.
+    As escritas rodam dentro de `_exclusivo()`, que exclui os outros workers:
+    sincronizar, alocar o id e gravar acontecem sem ninguém no meio, e os ids
+    nunca se repetem (a sequência é persistida, mesmo após a limpeza).
+
+    Internamente 'Bordador' é o id da `TabelaBordadores`; os métodos públicos
+    recebem e devolvem registros com o nome (`_codificar`/`_decodificar`).
+    Um nome novo vira uma operação 'bordador' gravada antes do registro.
+
+    Cada operação gravada leva uma versão ('v'), a mesma em todos os workers.
+    `self._mudancas` guarda, por id, a versão da última mudança (ids ausentes
+    de `_por_id` são exclusões) e responde `mudancas(desde)` para as versões
+    acima de `self._mudancas_desde`.
+
+    Subclasses implementam a persistência:
+      _mudanca()        -> None, 'novas' (só operações novas) ou 'tudo'
+      _ler_tudo()       -> (registros, próximo id persistido, {id: nome} ou
+                           None se os registros ainda trazem o nome, versão)
+                           e reinicia o cursor
+      _ler_novas()      -> operações gravadas depois do cursor
+      _exclusivo()      -> context manager com o lock de escrita entre processos
+      _gravar(op)       -> persiste uma operação (devolve o que `_confirmar` espera)
+      _confirmar(x)     -> espera a escrita chegar ao disco, já fora dos locks
+                           (depois dela, `_concluir` chama `self.ouvintes`)
+      _gravar_tudo(lst) -> regrava o conjunto inteiro (com o dicionário de bordadores
+                           e a versão)
+    """
+
+    # acima disto (registros mudados numa releitura), o evento pede recarga completa
+    LIMITE_EVENTO = 1000
+    # ids guardados no log de mudanças; os mais antigos saem (e o log passa a
+    # cobrir só as versões depois deles)
+    LIMITE_MUDANCAS = 50000
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._carregado = False
+        self._por_id = {}
+        self._proximo_id = 1
+        self._bordadores = TabelaBordadores()
+        self._indice = IndiceDataBordador()
+        self._colunas = ColunasNumericas()
+        self._agregados = AgregadosDiarios()
+        self._pedidos = ResumoPedidos()
+        self._prefixos = PrefixosPedidos()
+        self._indices = [self._bordadores, self._indice, self._colunas, self._agregados, self._pedidos,
+                         self._prefixos]
+        # chamados (sem argumentos) depois de cada escrita concluída
+        self.ouvintes = []
+        # chamados com o evento de cada mudança aplicada em memória, inclusive as
+        # gravadas por outros workers (lidas em sincronizar), ainda com o lock
+        self.observadores = []
+        self._versao = 0
+        self._mudancas = OrderedDict()
+        self._mudancas_desde = None
+        # relendo tudo: as operações reaplicadas não vão para o log nem para os
+        # observadores; a diferença para o estado anterior vai, no fim
+        self._relendo = False
+
+    def sincronizar(self):
+        """Relê o que mudou no armazenamento desde a última leitura."""
+        with self._lock:
+            mudanca = self._mudanca() if self._carregado else 'tudo'
+            legado = False
+            if mudanca == 'tudo':
+                anteriores, versao_anterior = self._por_id, self._versao
+                nomes_anteriores = dict(self._bordadores.nomes)
+                registros, proximo_id, nomes, versao = self._ler_tudo()
+                legado = nomes is None
+                self._relendo = True
+                try:
+                    self._indexar(registros, proximo_id, nomes or {}, versao)
+                    for operacao in self._ler_novas():
+                        self._aplicar(operacao)
+                finally:
+                    self._relendo = False
+                self._carregado = True
+                self._anotar_releitura(anteriores, versao_anterior, nomes_anteriores)
+            elif mudanca:
+                for operacao in self._ler_novas():
+                    self._aplicar(operacao)
+            if legado:
+                self._migrar_bordadores()
+
+    def _migrar_bordadores(self):
+        """Regrava os dados antigos (nome do bordador em cada registro) com o dicionário."""
+        with self._exclusivo():
+            self.sincronizar()
+            self._gravar_tudo(list(self._por_id.values()))
+        app.logger.info(f"[armazem] {len(self._bordadores.nomes)} bordadores migrados para o dicionário")
+
+    def _indexar(self, registros, proximo_id=1, nomes=None, versao=0):
+        ids = [r.get('id') for r in registros if isinstance(r.get('id'), int)]
+        maior = max(ids, default=0)
+        por_id = {}
+        self._bordadores.carregar(nomes or {})
+        for registro in registros:
+            rid = registro.get('id')
+            # ids duplicados (gerados pelo antigo len(dados) + 1) ganham um id novo
+            if not isinstance(rid, int) or rid in por_id:
+                maior += 1
+                app.logger.warning(f"[armazem] registro com id inválido/duplicado {rid!r} renumerado para {maior}")
+                registro['id'] = rid = maior
+            por_id[rid] = self._codificar_legado(registro)
+        # os índices leem os dicts; em memória ficam só os registros compactos
+        self._por_id = {rid: RegistroCompacto.de(r) for rid, r in por_id.items()}
+        self._proximo_id = max(maior + 1, proximo_id)
+        self._versao = versao
+        registros = list(por_id.values())
+        for indice in self._indices:
+            indice.reconstruir(registros)
+
+    def _anotar_releitura(self, anteriores, versao_anterior, nomes_anteriores=None):
+        """Depois de reler tudo (compactação, limpeza ou restauração), leva só a
+        diferença para o estado anterior ao log e aos observadores; se ela for
+        grande, o log recomeça na versão atual e o evento pede recarga completa."""
+        if self._mudancas_desde is None:
+            # primeira leitura: o log começa aqui
+            self._mudancas_desde = self._versao
+            return
+        nomes = self._bordadores.nomes
+        # bordador renomeado: o registro é o mesmo, mas sai com outro nome
+        renomeados = {c for c, nome in (nomes_anteriores or nomes).items() if nomes.get(c) != nome}
+        alterados = [r for rid, r in self._por_id.items()
+                     if anteriores.get(rid) != r or r.get('Bordador') in renomeados]
+        removidos = [rid for rid in anteriores if rid not in self._por_id]
+        if len(alterados) + len(removidos) > self.LIMITE_EVENTO or self._versao < versao_anterior:
+            self._mudancas.clear()
+            self._mudancas_desde = self._versao
+            self._notificar('recarregar')
+        elif alterados or removidos:
+            self._anotar([r['id'] for r in alterados] + removidos)
+            codigos = {r.get('Bordador') for r in alterados}
+            codigos.update(anteriores[rid].get('Bordador') for rid in removidos)
+            self._notificar('lote', registros=alterados, removidos=removidos, codigos=codigos)
+
+    def _anotar(self, ids):
+        """Marca os ids como mudados na versão atual (fim do log)."""
+        if self._relendo:
+            return
+        for rid in ids:
+            self._mudancas[rid] = self._versao
+            self._mudancas.move_to_end(rid)
+        while len(self._mudancas) > self.LIMITE_MUDANCAS:
+            self._mudancas_desde = self._mudancas.popitem(last=False)[1]
+
+    def _codificar_legado(self, registro):
+        # registro com o nome do bordador (arquivo ou journal antigo): o id é
+        # alocado só em memória, do mesmo jeito em todos os workers
+        nome = registro.get('Bordador')
+        if not isinstance(nome, str):
+            return registro
+        codigo = self._bordadores.ids.get(nome)
+        if codigo is None:
+            codigo = self._bordadores.proximo_id()
+            self._bordadores.definir(codigo, nome)
+        return {**registro, 'Bordador': codigo}
+
+    def _codificar(self, registro):
+        """Troca o nome do bordador pelo id, gravando uma operação para nomes novos."""
+        nome = registro.get('Bordador')
+        if nome is None:
+            return registro
+        nome = str(nome)
+        codigo = self._bordadores.ids.get(nome)
+        if codigo is None:
+            codigo = self._bordadores.proximo_id()
+            self._registrar({'op': 'bordador', 'id': codigo, 'nome': nome})
+        return {**registro, 'Bordador': codigo}
+
+    def _decodificar(self, registro):
+        if isinstance(registro, RegistroCompacto):
+            registro = registro.como_dict()
+        codigo = registro.get('Bordador')
+        if not isinstance(codigo, int):
+            return registro
+        return {**registro, 'Bordador': self._bordadores.nomes.get(codigo)}
+
+    def _codigo_bordador(self, nome):
+        """Id do bordador para os filtros: None sem filtro, -1 se o nome não existe."""
+        if not nome:
+            return None
+        return self._bordadores.ids.get(nome, -1)
+
+    def _aplicar(self, operacao):
+        # Reaplicar uma operação é idempotente: o estado é indexado pelo id.
+        self._versao = max(self._versao, operacao.get('v', 0))
+        if operacao['op'] in ('insert', 'update'):
+            registro = self._codificar_legado(operacao['registro'])
+            antigo = self._por_id.get(registro['id'])
+            self._por_id[registro['id']] = RegistroCompacto.de(registro)
+            self._proximo_id = max(self._proximo_id, registro['id'] + 1)
+        elif operacao['op'] == 'delete':
+            registro = None
+            antigo = self._por_id.pop(operacao['id'], None)
+        elif operacao['op'] == 'lote':
+            registros = [self._codificar_legado(r) for r in operacao['registros']]
+            antigos = [self._por_id[r['id']] for r in registros if r['id'] in self._por_id]
+            for registro in registros:
+                self._por_id[registro['id']] = RegistroCompacto.de(registro)
+            self._proximo_id = max(self._proximo_id, max(r['id'] for r in registros) + 1)
+            for indice in self._indices:
+                for antigo in antigos:
+                    indice.remover(antigo)
+                indice.adicionar_varios(registros)
+            self._anotar([r['id'] for r in registros])
+            self._notificar('lote', registros=registros,
+                            codigos={r.get('Bordador') for r in registros + antigos})
+            return
+        elif operacao['op'] == 'bordador':
+            anterior = self._bordadores.nomes.get(operacao['id'])
+            self._bordadores.definir(operacao['id'], operacao['nome'])
+            if anterior is not None and anterior != operacao['nome']:
+                # os registros do bordador passam a sair com o nome novo
+                self._anotar(self._indice.ids(bordador=operacao['id']))
+            self._notificar('bordador', codigos=[operacao['id']], nome=operacao['nome'], anterior=anterior)
+            return
+        elif operacao['op'] == 'rename':
+            de, para = operacao['de'], operacao['para']
+            if isinstance(de, str):
+                # journal antigo: a renomeação vinha com os nomes
+                nome, de, para = para, self._bordadores.ids.get(de), self._bordadores.ids.get(para)
+                if de is None:
+                    return
+                if para is None:
+                    self._bordadores.definir(de, nome)
+                    return
+            # o nome novo já existia: os registros passam para o id dele
+            ids = self._indice.ids(bordador=de)
+            for rid in ids:
+                self._por_id[rid] = RegistroCompacto.de({**self._por_id[rid].como_dict(), 'Bordador': para})
+            self._anotar(ids)
+            for indice in self._indices:
+                indice.renomear_bordador(de, para)
+            anterior = self._bordadores.nomes.get(de)
+            self._bordadores.descartar(de)
+            self._notificar('bordador', codigos=[para], nome=self._bordadores.nomes.get(para), anterior=anterior)
+            return
+        elif operacao['op'] == 'seq':
+            # a sequência de ids continua de onde parou, mesmo sem os registros
+            self._proximo_id = max(self._proximo_id, operacao['proximo_id'])
+            return
+        else:
+            return
+        for indice in self._indices:
+            if antigo is not None:
+                indice.remover(antigo)
+            if registro is not None:
+                indice.adicionar(registro)
+        if registro is not None:
+            self._anotar([registro['id']])
+            codigos = {registro.get('Bordador'), antigo.get('Bordador') if antigo else None}
+            self._notificar(operacao['op'], registros=[registro], codigos=codigos)
+        elif antigo is not None:
+            self._anotar([antigo['id']])
+            self._notificar('delete', removidos=[antigo['id']], codigos=[antigo.get('Bordador')])
+
+    def _notificar(self, tipo, registros=(), removidos=(), codigos=(), **extra):
+        """Evento da mudança para `self.observadores`: os registros alterados (com
+        o nome do bordador), os ids removidos e os totais dos bordadores afetados."""
+        if not self.observadores or self._relendo:
+            return
+        nomes = self._bordadores.nomes
+        evento = {
+            'tipo': tipo,
+            'versao': self._versao,
+            'registros': [self._decodificar(r) for r in registros],
+            'removidos': list(removidos),
+            'totais': {nomes[c]: self._agregados.totais(c) for c in codigos if c in nomes},
+            'geral': self._agregados.totais(),
+            **extra
+        }
+        for observador in self.observadores:
+            observador(evento)
+
+    def _validar(self, operacao):
+        """Compacta os registros da operação e passa-os por índices vazios.
+
+        Uma operação que falha ao ser aplicada levanta a exceção aqui, antes
+        de ser gravada: no journal ela quebraria cada releitura dos workers.
+        """
+        if operacao['op'] in ('insert', 'update'):
+            registros = [operacao['registro']]
+        elif operacao['op'] == 'lote':
+            registros = operacao['registros']
+        else:
+            return
+        for registro in registros:
+            RegistroCompacto.de(registro)
+        for indice in self._indices:
+            type(indice)().adicionar_varios(registros)
+
+    def _registrar(self, operacao):
+        """Valida e persiste a operação (com a próxima versão) e aplica-a em memória."""
+        self._validar(operacao)
+        operacao['v'] = self._versao + 1
+        confirmacao = self._gravar(operacao)
+        self._aplicar(operacao)
+        return confirmacao
+
+    @contextmanager
+    def _exclusivo(self):
+        yield
+
+    def _confirmar(self, confirmacao):
+        pass
+
+    def _concluir(self, confirmacao):
+        """Depois de gravar e soltar os locks: espera o disco e avisa os ouvintes."""
+        self._confirmar(confirmacao)
+        for ouvinte in self.ouvintes:
+            ouvinte()
+
+    def registros(self):
+        """Lista (nova) com todos os registros, na ordem de inserção."""
+        with self._lock:
+            self.sincronizar()
+            return [self._decodificar(r) for r in self._por_id.values()]
+
+    def obter(self, id):
+        with self._lock:
+            self.sincronizar()
+            registro = self._por_id.get(id)
+            return self._decodificar(registro) if registro is not None else None
+
+    def filtrar(self, bordador=None, data_inicio=None, data_fim=None):
+        """Registros do bordador e/ou do período (o período exige as duas datas)."""
+        with self._lock:
+            self.sincronizar()
+            if not bordador and not (data_inicio and data_fim):
+                return [self._decodificar(r) for r in self._por_id.values()]
+            ids = self._indice.ids(self._codigo_bordador(bordador), data_inicio, data_fim)
+            return [self._decodificar(self._por_id[i]) for i in ids]
+
+    def pagina(self, bordador=None, data_inicio=None, data_fim=None, apos=None, limite=None):
+        """Como `filtrar`, paginado por id: (registros, total, próximo cursor)."""
+        with self._lock:
+            self.sincronizar()
+            ids, total, proximo = self._indice.pagina(
+                self._codigo_bordador(bordador), data_inicio, data_fim, apos, limite
+            )
+            return [self._decodificar(self._por_id[i]) for i in ids], total, proximo
+
+    def pagina_em_partes(self, bordador=None, data_inicio=None, data_fim=None, apos=None, limite=None, tamanho=500):
+        """Como `pagina`, mas os registros vêm num gerador de blocos de até `tamanho`.
+
+        Só os ids da página são separados agora; cada bloco é decodificado
+        (com o lock) quando o gerador chega nele, e a resposta nunca tem a
+        página inteira montada em memória. Registros excluídos nesse meio
+        tempo ficam de fora. Retorna (blocos, total, próximo cursor).
+        """
+        with self._lock:
+            self.sincronizar()
+            ids, total, proximo = self._indice.pagina(
+                self._codigo_bordador(bordador), data_inicio, data_fim, apos, limite
+            )
+        return self._blocos(ids, tamanho), total, proximo
+
+    def _blocos(self, ids, tamanho):
+        for inicio in range(0, len(ids), tamanho):
+            with self._lock:
+                bloco = [self._decodificar(self._por_id[i]) for i in ids[inicio:inicio + tamanho] if i in self._por_id]
+            yield bloco
+
+    def por_pedido(self, pedido_id):
+        with self._lock:
+            self.sincronizar()
+            pedido = self._pedidos.pedidos.get(pedido_id)
+            return [self._decodificar(self._por_id[i]) for i in sorted(pedido['ids'])] if pedido else []
+
+    def resumo_pedido(self, pedido_id, arquivados=()):
+        """Bordadores, posições, tipos, processos e totais do pedido, ou None.
+
+        Com `arquivados` (os registros do pedido no histórico), o resumo é
+        montado de novo a partir deles e dos registros atuais.
+        """
+        with self._lock:
+            self.sincronizar()
+            nomes = self._bordadores.nomes
+            if not arquivados:
+                return self._pedidos.resultado(
+                    pedido_id, self._por_id, lambda codigo: nomes.get(codigo) if isinstance(codigo, int) else codigo
+                )
+            pedido = self._pedidos.pedidos.get(pedido_id)
+            atuais = [self._decodificar(self._por_id[i]) for i in pedido['ids']] if pedido else []
+        registros = sorted(atuais + list(arquivados), key=lambda r: r['id'])
+        resumo = ResumoPedidos()
+        resumo.reconstruir(registros)
+        return resumo.resultado(pedido_id, {r['id']: r for r in registros}, lambda nome: nome)
+
+    def sugerir_pedidos(self, texto, limite, arquivados=None):
+        """Pedidos cujo ID (ou FOLHA) começa com `texto`, com a contagem de registros.
+
+        `arquivados` é o `PrefixosPedidos` do histórico, somado aos atuais.
+        """
+        with self._lock:
+            self.sincronizar()
+            return self._prefixos.sugerir(texto, limite, [arquivados] if arquivados else ())
+
+    def versao(self):
+        """Versão da última operação aplicada (a referência para `mudancas`)."""
+        with self._lock:
+            self.sincronizar()
+            return self._versao
+
+    def mudancas(self, desde, bordador=None, data_inicio=None, data_fim=None):
+        """(versão atual, registros alterados, ids removidos) depois da versão `desde`.
+
+        Registros alterados que não passam no filtro (bordador e/ou período com
+        as duas datas) vêm entre os removidos. Se o log não cobre mais `desde`
+        (foi truncado, o worker acabou de subir ou a versão é de outro conjunto
+        de dados), retorna (versão atual, None, None): o cliente recarrega tudo.
+        """
+        with self._lock:
+            self.sincronizar()
+            if desde < self._mudancas_desde or desde > self._versao:
+                return self._versao, None, None
+            codigo = self._codigo_bordador(bordador)
+            periodo = data_inicio and data_fim
+            registros, removidos = [], []
+            for rid in reversed(self._mudancas):
+                if self._mudancas[rid] <= desde:
+                    break
+                registro = self._por_id.get(rid)
+                if (registro is None or (codigo is not None and registro.get('Bordador') != codigo)
+                        or (periodo and not data_inicio <= str(registro.get('Data') or '') <= data_fim)):
+                    removidos.append(rid)
+                else:
+                    registros.append(self._decodificar(registro))
+            registros.reverse()
+            removidos.reverse()
+            return self._versao, registros, removidos
+
+    def nomes_bordadores(self):
+        """{id: nome} do dicionário de bordadores (o histórico arquivado guarda os ids)."""
+        with self._lock:
+            self.sincronizar()
+            return dict(self._bordadores.nomes)
+
+    def referencias(self, bordador):
+        """Quantos registros usam o bordador (contador mantido a cada operação)."""
+        with self._lock:
+            self.sincronizar()
+            return self._bordadores.referencias.get(self._bordadores.ids.get(bordador), 0)
+
+    def estatisticas(self, bordador=None, data_inicio=None, data_fim=None):
+        """Total de registros, peças e pontos do bordador e/ou período."""
+        with self._lock:
+            self.sincronizar()
+            return self._agregados.totais(self._codigo_bordador(bordador), data_inicio, data_fim)
+
+    def serie(self, granularidade, bordador=None, data_inicio=None, data_fim=None, arquivados=()):
+        """Registros, peças e pontos por período ('dia', 'semana' ou 'mes'), no total e por bordador.
+
+        Os períodos sem produção ficam de fora; as listas de cada bordador e do
+        total são alinhadas com `periodos`. `arquivados` são células
+        (bordador, Data, [registros, peças, pontos]) do histórico, somadas às
+        atuais. ValueError se as datas forem inválidas.
+        """
+        with self._lock:
+            self.sincronizar()
+            codigo = self._codigo_bordador(bordador)
+            mascara = self._colunas.mascara(codigo, data_inicio, data_fim) if codigo != -1 else np.zeros(self._colunas.n, bool)
+            periodos, codigos, registros, pecas, pontos = self._colunas.serie(mascara, granularidade)
+            nomes = {c: self._bordadores.nomes.get(c, c) if isinstance(c, int) else c for c in set(codigos.tolist())}
+        rotulos = np.array([nomes[c] for c in codigos.tolist()], object)
+
+        celulas = []
+        for nome, dia, soma in arquivados:
+            try:
+                celulas.append((nome, data_ordinal(dia), *soma))
+            except ValueError:
+                continue
+        if celulas:
+            nomes_arq, dias_arq, *somas_arq = zip(*celulas)
+            periodos = np.concatenate((periodos, ColunasNumericas.periodos(np.array(dias_arq, np.int64), granularidade)))
+            rotulos = np.concatenate((rotulos, np.array(nomes_arq, object)))
+            registros, pecas, pontos = (np.concatenate((atual, np.array(arq, np.int64)))
+                                        for atual, arq in zip((registros, pecas, pontos), somas_arq))
+
+        distintos = np.unique(periodos)
+        posicao = np.searchsorted(distintos, periodos)
+        colunas = {'registros': registros, 'pecas': pecas, 'pontos': pontos}
+        total = {}
+        for campo, valores in colunas.items():
+            total[campo] = np.zeros(len(distintos), np.int64)
+            np.add.at(total[campo], posicao, valores)
+        por_bordador = {}
+        for nome in sorted(set(rotulos.tolist()), key=str):
+            linhas = rotulos == nome
+            por_bordador[nome] = {}
+            for campo, valores in colunas.items():
+                coluna = np.zeros(len(distintos), np.int64)
+                np.add.at(coluna, posicao[linhas], valores[linhas])
+                por_bordador[nome][campo] = coluna.tolist()
+        formato = '%Y-%m' if granularidade == 'mes' else '%Y-%m-%d'
+        return {
+            'periodos': [date.fromordinal(int(p)).strftime(formato) for p in distintos],
+            'total': {campo: valores.tolist() for campo, valores in total.items()},
+            'bordadores': por_bordador
+        }
+
+    def ranking(self, k, criterio='pontos', data_inicio=None, data_fim=None, arquivados=None):
+        """Os k bordadores com mais pontos (ou peças) no período, do maior para o menor.
+
+        `arquivados` ({bordador: [registros, peças, pontos]} do histórico) é
+        somado aos totais atuais de cada bordador antes de escolher os k.
+        """
+        campo = {'registros': 0, 'pecas': 1, 'pontos': 2}[criterio]
+        with self._lock:
+            self.sincronizar()
+            nome = lambda codigo: self._bordadores.nomes.get(codigo, codigo) if isinstance(codigo, int) else codigo
+            if not arquivados:
+                melhores = [(nome(codigo), soma)
+                            for codigo, soma in self._agregados.ranking(k, campo, data_inicio, data_fim, nome)]
+            else:
+                somas = {nome: list(valores) for nome, valores in arquivados.items()}
+                for codigo, valores in self._agregados.por_bordador(data_inicio, data_fim):
+                    atual = somas.setdefault(nome(codigo), [0, 0, 0])
+                    for i, valor in enumerate(valores):
+                        atual[i] += valor
+                melhores = AgregadosDiarios.melhores(k, campo, somas.items())
+        return [{
+            'posicao': posicao,
+            'bordador': nome,
+            'total_registros': soma[0],
+            'total_pecas': soma[1],
+            'total_pontos': soma[2]
+        } for posicao, (nome, soma) in enumerate(melhores, 1)]
+
+    def consulta(self, com=(), sem=(), bordador=None, data_inicio=None, data_fim=None, pedido=None,
+                 registros=False, apos=None, limite=None):
+        """Totais dos registros com as marcas `com`, sem as marcas `sem` e dos demais filtros.
+
+        Os filtros viram máscaras sobre as colunas (bordador, período, ids do
+        pedido) e um AND com o bitmap de cada marca; os totais e a contagem por
+        marca saem das máscaras, sem montar registros. Só com `registros` vem a
+        página dos registros (paginada por id). Retorna (totais, registros,
+        próximo cursor); ValueError se as datas forem inválidas.
+        """
+        with self._lock:
+            self.sincronizar()
+            mascara = self._colunas.mascara(self._codigo_bordador(bordador), data_inicio, data_fim)
+            if pedido:
+                resumo = self._pedidos.pedidos.get(pedido)
+                mascara &= self._colunas.mascara_ids(resumo['ids'] if resumo else ())
+            mascara = self._colunas.filtrar_marcas(mascara, com, sem)
+            totais = self._colunas.totais(mascara)
+            totais['marcas'] = self._colunas.contar_marcas(mascara)
+            if not registros:
+                return totais, None, None
+            ids = self._colunas.ids_da_mascara(mascara)
+            if apos is not None:
+                ids = ids[np.searchsorted(ids, apos, side='right'):]
+            proximo = None
+            if limite is not None and len(ids) > limite:
+                ids = ids[:limite]
+                proximo = int(ids[-1])
+            return totais, [self._decodificar(self._por_id[int(i)]) for i in ids], proximo
+
+    def verificar_agregados(self):
+        """Recalcula os agregados a partir dos registros; corrige e retorna False se divergirem."""
+        with self._lock:
+            self.sincronizar()
+            recalculado = AgregadosDiarios()
+            recalculado.reconstruir(list(self._por_id.values()))
+            if recalculado.igual(self._agregados):
+                return True
+            app.logger.warning("[armazem] agregados divergentes dos registros; reconstruídos")
+            self._indices[self._indices.index(self._agregados)] = recalculado
+            self._agregados = recalculado
+            return False
+
+    def numeros(self, id):
+        """QTD e PONTOS do registro, já convertidos em inteiros."""
+        with self._lock:
+            self.sincronizar()
+            return self._colunas.numeros(id)
+
+    def inserir(self, dados):
+        with self._lock, self._exclusivo():
+            self.sincronizar()
+            novo_id = self._proximo_id
+            registro = {
+                'id': novo_id,
+                'timestamp': datetime.now().isoformat(),
+                **dados
+            }
+            registro['id'] = novo_id
+            confirmacao = self._registrar({'op': 'insert', 'registro': self._codificar(registro)})
+        self._concluir(confirmacao)
+        return registro
+
+    def inserir_lote(self, lista):
+        """Inclui vários registros com uma única operação: ids alocados de uma vez,
+        índices atualizados uma vez e uma só gravação."""
+        if not lista:
+            return []
+        with self._lock, self._exclusivo():
+            self.sincronizar()
+            agora = datetime.now().isoformat()
+            registros = [
+                {'id': novo_id, 'timestamp': agora, **dados, 'id': novo_id}
+                for novo_id, dados in enumerate(lista, self._proximo_id)
+            ]
+            codificados = [self._codificar(r) for r in registros]
+            confirmacao = self._registrar({'op': 'lote', 'registros': codificados})
+        self._concluir(confirmacao)
+        return registros
+
+    def atualizar(self, id, dados):
+        """Mescla `dados` no registro; retorna o registro novo ou None."""
+        with self._lock, self._exclusivo():
+            self.sincronizar()
+            registro = self._por_id.get(id)
+            if registro is None:
+                return None
+            novo = {**self._decodificar(registro), **dados, 'id': id}
+            confirmacao = self._registrar({'op': 'update', 'registro': self._codificar(novo)})
+        self._concluir(confirmacao)
+        return novo
+
+    def remover(self, id):
+        with self._lock, self._exclusivo():
+            self.sincronizar()
+            if id not in self._por_id:
+                return False
+            confirmacao = self._registrar({'op': 'delete', 'id': id})
+        self._concluir(confirmacao)
+        return True
+
+    def remover_exportados(self, exportados, arquivo=None):
+        """Remove os registros exportados que não mudaram desde a exportação.
+
+        Registros incluídos ou alterados enquanto a exportação rodava ficam.
+        Com `arquivo`, os removidos são gravados nele antes (ainda com os
+        outros workers excluídos). Retorna quantos foram removidos.
+        """
+        with self._lock, self._exclusivo():
+            self.sincronizar()
+            por_id = {r['id']: r for r in exportados}
+            restantes, saem = [], []
+            for registro in self._por_id.values():
+                (saem if por_id.get(registro['id']) == self._decodificar(registro) else restantes).append(registro)
+            removidos = len(saem)
+            if removidos:
+                if arquivo is not None:
+                    # com o id do bordador, como no armazém
+                    arquivo.arquivar([r.como_dict() for r in saem])
+                self._substituir(restantes)
+        if removidos:
+            self._concluir(None)
+        return removidos
+
+    def renomear_bordador(self, antigo, novo, arquivo=None):
+        """Renomeia o bordador: só a entrada do dicionário muda, não os registros.
+
+        Se `novo` já está no dicionário, os registros de `antigo` passam para ele,
+        e também os arquivados em `arquivo`, antes de gravar a operação.
+        """
+        with self._lock, self._exclusivo():
+            self.sincronizar()
+            de = self._bordadores.ids.get(antigo)
+            if not antigo or not novo or antigo == novo or de is None:
+                return
+            para = self._bordadores.ids.get(novo)
+            if para is None:
+                operacao = {'op': 'bordador', 'id': de, 'nome': novo}
+            else:
+                if arquivo is not None:
+                    arquivo.renomear_bordador(de, para)
+                operacao = {'op': 'rename', 'de': de, 'para': para}
+            confirmacao = self._registrar(operacao)
+        self._concluir(confirmacao)
+
+    def substituir(self, registros):
+        """Regrava todos os registros (renomeações em massa, limpeza pós-exportação)."""
+        with self._lock, self._exclusivo():
+            self._substituir(registros)
+        self._concluir(None)
+
+    def _substituir(self, registros):
+        self.sincronizar()
+        anteriores, versao_anterior = self._por_id, self._versao
+        nomes_anteriores = dict(self._bordadores.nomes)
+        registros = [r.como_dict() if isinstance(r, RegistroCompacto) else r for r in registros]
+        self._indexar(registros, self._proximo_id, self._bordadores.nomes, self._versao + 1)
+        self._gravar_tudo(list(self._por_id.values()))
+        self._carregado = True
+        self._anotar_releitura(anteriores, versao_anterior, nomes_anteriores)
+
+
+def gravar_arquivo_atomico(caminho, conteudo):
+    """Grava num arquivo temporário e troca com rename: nunca deixa o arquivo truncado."""
+    modo = 'wb' if isinstance(conteudo, bytes) else 'w'
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, modo, **({} if modo == 'wb' else {'encoding': 'utf-8'})) as f:
+        f.write(conteudo)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+
+class CommitEmGrupo:
+    """fsync compartilhado entre as threads que escreveram no mesmo arquivo.
+
+    Cada escrita recebe um número (`registrar`) e, já fora dos locks, espera em
+    `aguardar` até estar em disco. Quem chega sem fsync em andamento vira o
+    líder e sincroniza o arquivo por todas as escritas feitas até ali; as que
+    chegam durante o fsync esperam o próximo. Com N escritas concorrentes são
+    poucos fsync em vez de N.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._cond = threading.Condition()
+        self._escritas = 0
+        self._duraveis = 0
+        self._sincronizando = False
+
+    def registrar(self):
+        with self._cond:
+            self._escritas += 1
+            return self._escritas
+
+    def aguardar(self, numero):
+        with self._cond:
+            while self._duraveis < numero:
+                if self._sincronizando:
+                    self._cond.wait()
+                    continue
+                self._sincronizando = True
+                alvo = self._escritas
+                self._cond.release()
+                try:
+                    fd = os.open(self.caminho, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                finally:
+                    self._cond.acquire()
+                    self._sincronizando = False
+                    self._cond.notify_all()
+                self._duraveis = max(self._duraveis, alvo)
+
+
+class ArmazemJSON(ArmazemProducao):
+    """Snapshot JSON mais journal de escrita.
+
+    O estado em disco é o snapshot (`caminho`) mais o journal (`caminho_journal`),
+    um arquivo JSONL com uma operação por linha. Cada escrita só acrescenta uma
+    linha ao journal; quando ele passa de `limite_journal` bytes, uma thread em
+    segundo plano grava um snapshot novo (arquivo temporário + rename) e
+    descarta a parte já incorporada. Se apenas o journal cresceu desde a última
+    leitura, só as linhas novas são reaplicadas.
+
+    O snapshot é {"bordadores": {id: nome}, "registros": [...]}; uma lista
+    simples (formato antigo, com o nome em cada registro) é migrada na
+    primeira leitura.
+
+    Entre workers, as escritas e a troca de arquivos da compactação são
+    serializadas por um flock em `caminho_lock`. O journal regravado começa
+    com uma operação 'seq' que guarda o próximo id. O fsync das linhas é feito
+    em grupo (`CommitEmGrupo`) depois de soltar o lock.
+    """
+
+    def __init__(self, caminho, caminho_journal, limite_journal, caminho_lock=LOCK_FILE):
+        super().__init__()
+        self.caminho = caminho
+        self.caminho_journal = caminho_journal
+        self.limite_journal = limite_journal
+        self.caminho_lock = caminho_lock
+        self._assinatura = None
+        self._inode_journal = None
+        self._offset_journal = 0
+        self._compactando = False
+        self._commit = CommitEmGrupo(caminho_journal)
+        self._fd_lock = None
+        self._pid_lock = None
+        self._profundidade = 0
+
+    @contextmanager
+    def _exclusivo(self):
+        # chamado sempre com self._lock: as threads do worker já estão em fila
+        if self._profundidade == 0 and fcntl is not None:
+            # o descritor herdado num fork dividiria o lock com o processo pai
+            if self._fd_lock is None or self._pid_lock != os.getpid():
+                self._fd_lock = os.open(self.caminho_lock, os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid_lock = os.getpid()
+            fcntl.flock(self._fd_lock, fcntl.LOCK_EX)
+        self._profundidade += 1
+        try:
+            yield
+        except BaseException:
+            # a memória pode ter ficado à frente do disco: relê na próxima vez
+            self._carregado = False
+            raise
+        finally:
+            self._profundidade -= 1
+            if self._profundidade == 0 and fcntl is not None:
+                fcntl.flock(self._fd_lock, fcntl.LOCK_UN)
+
+    def _assinatura_arquivo(self):
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _estado_journal(self):
+        try:
+            st = os.stat(self.caminho_journal)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def _mudanca(self):
+        inode, tamanho = self._estado_journal()
+        if (self._assinatura_arquivo() != self._assinatura or inode != self._inode_journal
+                or tamanho < self._offset_journal):
+            return 'tudo'
+        if tamanho > self._offset_journal:
+            return 'novas'
+        return None
+
+    def _ler_tudo(self):
+        self._assinatura = self._assinatura_arquivo()
+        self._inode_journal = self._estado_journal()[0]
+        self._offset_journal = 0
+        if self._assinatura is None:
+            return [], 1, {}, 0
+        with open(self.caminho, 'rb') as f:
+            snapshot = json_ler(f.read())
+        # o próximo id persistido vem da operação 'seq' no início do journal
+        if isinstance(snapshot, list):
+            return snapshot, 1, None, 0
+        nomes = {int(codigo): nome for codigo, nome in snapshot['bordadores'].items()}
+        return snapshot['registros'], 1, nomes, snapshot.get('versao', 0)
+
+    def _ler_novas(self):
+        """Operações das linhas completas do journal a partir do último offset lido."""
+        if self._estado_journal()[1] <= self._offset_journal:
+            return []
+        with open(self.caminho_journal, 'rb') as f:
+            f.seek(self._offset_journal)
+            pendente = f.read()
+        # uma linha sem '\n' final é uma escrita interrompida (ou ainda em curso)
+        completo = pendente[:pendente.rfind(b'\n') + 1]
+        self._offset_journal += len(completo)
+        operacoes = []
+        for linha in completo.splitlines():
+            if not linha.strip():
+                continue
+            try:
+                operacoes.append(json_ler(linha))
+            except ValueError as e:
+                app.logger.warning(f"[armazem] linha inválida no journal ignorada: {e}")
+        return operacoes
+
+    def _gravar(self, operacao):
+        linha = json_bytes(operacao) + b'\n'
+        with open(self.caminho_journal, 'a+b') as f:
+            inicio = f.seek(0, os.SEEK_END)
+            if inicio:
+                # uma escrita interrompida deixa a última linha sem '\n'; isola-a
+                f.seek(inicio - 1)
+                if f.read(1) != b'\n':
+                    linha = b'\n' + linha
+            f.write(linha)
+            f.flush()
+            inode = os.fstat(f.fileno()).st_ino
+        # Se outro processo escreveu no meio, a próxima sincronização relê o trecho.
+        if inicio == self._offset_journal:
+            self._offset_journal += len(linha)
+            self._inode_journal = inode
+        if self._offset_journal > self.limite_journal and not self._compactando:
+            self._compactando = True
+            threading.Thread(target=self._compactar_em_segundo_plano, daemon=True).start()
+        return self._commit.registrar()
+
+    def _confirmar(self, confirmacao):
+        if confirmacao is not None:
+            self._commit.aguardar(confirmacao)
+
+    def _cabecalho_journal(self):
+        return json_bytes({'op': 'seq', 'proximo_id': self._proximo_id}) + b'\n'
+
+    @staticmethod
+    def _serializar(registros, nomes, versao):
+        # sem indentação: o snapshot é lido e gravado inteiro a cada compactação
+        registros = [r.como_dict() if isinstance(r, RegistroCompacto) else r for r in registros]
+        return json_bytes({'versao': versao, 'bordadores': nomes, 'registros': registros})
+
+    def _gravar_tudo(self, registros):
+        cabecalho = self._cabecalho_journal()
+        gravar_arquivo_atomico(self.caminho, self._serializar(registros, self._bordadores.nomes, self._versao))
+        gravar_arquivo_atomico(self.caminho_journal, cabecalho)
+        self._assinatura = self._assinatura_arquivo()
+        self._inode_journal = self._estado_journal()[0]
+        self._offset_journal = len(cabecalho)
+
+    def _compactar_em_segundo_plano(self):
+        try:
+            self.compactar()
+        except Exception as e:
+            app.logger.error(f"[armazem] erro ao compactar journal: {e}")
+        finally:
+            self._compactando = False
+
+    def compactar(self):
+        """Incorpora o journal num snapshot novo e mantém só o que veio depois."""
+        with self._lock:
+            self.sincronizar()
+            registros = list(self._por_id.values())
+            nomes = dict(self._bordadores.nomes)
+            versao = self._versao
+            corte = self._offset_journal
+            assinatura, inode = self._assinatura, self._inode_journal
+        # a serialização (O(N)) fica fora do lock; as escritas seguem no journal
+        conteudo = self._serializar(registros, nomes, versao)
+        with self._lock, self._exclusivo():
+            if self._assinatura_arquivo() != assinatura or self._estado_journal()[0] != inode:
+                return  # outro worker compactou (ou limpou) nesse meio tempo
+            with open(self.caminho_journal, 'rb') as f:
+                f.seek(corte)
+                resto = f.read()
+            cabecalho = self._cabecalho_journal()
+            gravar_arquivo_atomico(self.caminho, conteudo)
+            gravar_arquivo_atomico(self.caminho_journal, cabecalho + resto)
+            if self._assinatura == assinatura and self._inode_journal == inode:
+                self._assinatura = self._assinatura_arquivo()
+                self._inode_journal = self._estado_journal()[0]
+                self._offset_journal += len(cabecalho) - corte
+
+
+class ArmazemSQLite(ArmazemProducao):
+    """Registros, bordadores e usuários num banco SQLite.
+
+    A tabela `producao` guarda o registro inteiro (JSON) mais as colunas
+    indexadas data, bordador_id e pedido, usadas pelos filtros e pela busca de
+    pedido; os nomes dos bordadores ficam em `nomes_bordador`. Cada escrita também entra na tabela `operacoes`, que os outros
+    workers leem para atualizar o cache em memória sem recarregar tudo.
+    As escritas rodam numa transação BEGIN IMMEDIATE (o lock de escrita do
+    SQLite vale entre processos) e o próximo id fica em `meta`.
+    Na primeira abertura os arquivos JSON existentes são migrados.
+    """
+
+    LIMITE_OPERACOES = 10000
+
+    def __init__(self, caminho):
+        super().__init__()
+        self.caminho = caminho
+        self._db = None
+        self._pid = None
+        self._cursor = 0
+        self._geracao = None
+        self._data_version = None
+        self._profundidade = 0
+
+    @contextmanager
+    def _exclusivo(self):
+        db = self._conexao()
+        if self._profundidade == 0:
+            db.execute('BEGIN IMMEDIATE')
+        self._profundidade += 1
+        try:
+            yield
+        except BaseException:
+            self._profundidade -= 1
+            if self._profundidade == 0:
+                db.execute('ROLLBACK')
+                # a memória já pode ter aplicado o que não foi gravado
+                self._carregado = False
+            raise
+        self._profundidade -= 1
+        if self._profundidade == 0:
+            try:
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                self._carregado = False
+                raise
+
+    def _conexao(self):
+        # conexões SQLite não sobrevivem a fork (gunicorn --preload)
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.caminho, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA busy_timeout=5000')
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS producao (
+                    id INTEGER PRIMARY KEY,
+                    data TEXT,
+                    bordador_id INTEGER,
+                    pedido TEXT,
+                    registro TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_producao_data ON producao(data);
+                CREATE INDEX IF NOT EXISTS idx_producao_pedido ON producao(pedido);
+                CREATE TABLE IF NOT EXISTS nomes_bordador (
+                    id INTEGER PRIMARY KEY,
+                    nome TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS operacoes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    operacao TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS bordadores (
+                    posicao INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS usuarios (
+                    username TEXT PRIMARY KEY,
+                    senha TEXT NOT NULL,
+                    tipo TEXT NOT NULL,
+                    nome TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT
+                );
+            ''')
+            self._db, self._pid = db, os.getpid()
+            self._migrar_esquema()
+            db.execute('CREATE INDEX IF NOT EXISTS idx_producao_bordador_id_data ON producao(bordador_id, data)')
+            self._migrar_json()
+        return self._db
+
+    def _migrar_esquema(self):
+        """Bancos antigos guardam o nome do bordador em cada linha: passa para o dicionário."""
+        db = self._db
+        if any(coluna[1] == 'bordador_id' for coluna in db.execute('PRAGMA table_info(producao)')):
+            return
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if not any(coluna[1] == 'bordador_id' for coluna in db.execute('PRAGMA table_info(producao)')):
+                db.execute('ALTER TABLE producao ADD COLUMN bordador_id INTEGER')
+                db.execute('''
+                    INSERT OR IGNORE INTO nomes_bordador (nome)
+                    SELECT bordador FROM producao WHERE bordador IS NOT NULL
+                    GROUP BY bordador ORDER BY MIN(id)
+                ''')
+                db.execute('''
+                    UPDATE producao SET bordador_id = (SELECT id FROM nomes_bordador WHERE nome = producao.bordador)
+                    WHERE bordador IS NOT NULL
+                ''')
+                db.execute('''
+                    UPDATE producao SET bordador = NULL, registro = json_set(registro, '$.Bordador', bordador_id)
+                    WHERE bordador_id IS NOT NULL
+                ''')
+                db.execute('DROP INDEX IF EXISTS idx_producao_bordador_data')
+                # as operações antigas trazem nomes: os workers recarregam tudo
+                db.execute('DELETE FROM operacoes')
+                db.execute("UPDATE meta SET valor = CAST(valor AS INTEGER) + 1 WHERE chave = 'geracao'")
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def _migrar_json(self):
+        """Importa uma única vez os arquivos JSON (dados, journal, bordadores, usuários)."""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # bancos criados antes da sequência persistida (e da versão das operações)
+            db.execute(
+                "INSERT OR IGNORE INTO meta (chave, valor) "
+                "SELECT 'proximo_id', COALESCE(MAX(id), 0) + 1 FROM producao"
+            )
+            db.execute("INSERT OR IGNORE INTO meta (chave, valor) VALUES ('versao', '0')")
+            if db.execute("SELECT 1 FROM meta WHERE chave = 'migrado_json'").fetchone():
+                db.execute('COMMIT')
+                return
+            # só lê: sincronizar() num ArmazemJSON regravaria o snapshot e o
+            # journal (migração do formato antigo) durante a importação
+            arquivos = ArmazemJSON(DATA_FILE, JOURNAL_FILE, JOURNAL_LIMITE_BYTES)
+            origem = ArmazemProducao()
+            origem._indexar(*arquivos._ler_tudo())
+            for operacao in arquivos._ler_novas():
+                origem._aplicar(operacao)
+            registros = list(origem._por_id.values())
+            db.executemany(
+                'INSERT OR REPLACE INTO producao (id, data, bordador_id, pedido, registro) VALUES (?, ?, ?, ?, ?)',
+                [self._linha(r) for r in registros]
+            )
+            db.executemany('INSERT OR REPLACE INTO nomes_bordador (id, nome) VALUES (?, ?)',
+                           list(origem._bordadores.nomes.items()))
+            bordadores = ['João Silva', 'Maria Santos', 'Pedro Oliveira', 'Ana Costa']
+            if os.path.exists(BORDADORES_FILE):
+                with open(BORDADORES_FILE, 'r', encoding='utf-8') as f:
+                    bordadores = json.load(f)
+            db.executemany('INSERT OR IGNORE INTO bordadores (nome) VALUES (?)', [(b,) for b in bordadores])
+            if os.path.exists(USERS_FILE):
+                with open(USERS_FILE, 'r', encoding='utf-8') as f:
+                    usuarios = json.load(f)
+                db.executemany(
+                    'INSERT OR REPLACE INTO usuarios (username, senha, tipo, nome) VALUES (?, ?, ?, ?)',
+                    [(u, d['senha'], d['tipo'], d['nome']) for u, d in usuarios.items()]
+                )
+            db.execute("INSERT INTO meta (chave, valor) VALUES ('migrado_json', ?)", (datetime.now().isoformat(),))
+            db.execute("INSERT OR IGNORE INTO meta (chave, valor) VALUES ('geracao', '0')")
+            self._avancar_sequencia(origem._proximo_id)
+            db.execute("UPDATE meta SET valor = ? WHERE chave = 'versao'", (origem._versao,))
+            db.execute('COMMIT')
+            app.logger.info(f"[armazem] {len(registros)} registros migrados dos arquivos JSON para {self.caminho}")
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _linha(registro):
+        if isinstance(registro, RegistroCompacto):
+            registro = registro.como_dict()
+        return (registro['id'], registro.get('Data'), registro.get('Bordador'), registro.get('ID'),
+                json_bytes(registro).decode('utf-8'))
+
+    def _mudanca(self):
+        db = self._conexao()
+        # data_version só muda quando outra conexão grava no banco
+        data_version = db.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return None
+        self._data_version = data_version
+        geracao = db.execute("SELECT valor FROM meta WHERE chave = 'geracao'").fetchone()[0]
+        menor = db.execute('SELECT MIN(seq) FROM operacoes').fetchone()[0]
+        if geracao != self._geracao or (menor is not None and menor > self._cursor + 1):
+            return 'tudo'
+        return 'novas'
+
+    def _ler_tudo(self):
+        db = self._conexao()
+        # dentro de uma escrita a leitura já está na transação dela
+        propria = not db.in_transaction
+        if propria:
+            db.execute('BEGIN')
+        try:
+            self._data_version = db.execute('PRAGMA data_version').fetchone()[0]
+            self._geracao = db.execute("SELECT valor FROM meta WHERE chave = 'geracao'").fetchone()[0]
+            self._cursor = db.execute('SELECT COALESCE(MAX(seq), 0) FROM operacoes').fetchone()[0]
+            registros = [json_ler(r) for (r,) in db.execute('SELECT registro FROM producao ORDER BY id')]
+            proximo_id, versao = db.execute(
+                "SELECT CAST(p.valor AS INTEGER), CAST(v.valor AS INTEGER) FROM meta p, meta v "
+                "WHERE p.chave = 'proximo_id' AND v.chave = 'versao'"
+            ).fetchone()
+            nomes = dict(db.execute('SELECT id, nome FROM nomes_bordador'))
+        finally:
+            if propria:
+                db.execute('COMMIT')
+        return registros, proximo_id, nomes, versao
+
+    def _ler_novas(self):
+        linhas = self._conexao().execute(
+            'SELECT seq, operacao FROM operacoes WHERE seq > ? ORDER BY seq', (self._cursor,)
+        ).fetchall()
+        if linhas:
+            self._cursor = linhas[-1][0]
+        return [json_ler(op) for _, op in linhas]
+
+    def _avancar_sequencia(self, proximo_id):
+        self._db.execute(
+            "UPDATE meta SET valor = MAX(CAST(valor AS INTEGER), ?) WHERE chave = 'proximo_id'",
+            (proximo_id,)
+        )
+
+    # _gravar e _gravar_tudo rodam dentro da transação aberta por _exclusivo()
+    def _gravar(self, operacao):
+        db = self._conexao()
+        if operacao['op'] == 'delete':
+            db.execute('DELETE FROM producao WHERE id = ?', (operacao['id'],))
+        elif operacao['op'] == 'bordador':
+            db.execute(
+                'INSERT INTO nomes_bordador (id, nome) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET nome = excluded.nome',
+                (operacao['id'], operacao['nome'])
+            )
+        elif operacao['op'] == 'rename':
+            db.execute(
+                "UPDATE producao SET bordador_id = ?, registro = json_set(registro, '$.Bordador', ?) WHERE bordador_id = ?",
+                (operacao['para'], operacao['para'], operacao['de'])
+            )
+            db.execute('DELETE FROM nomes_bordador WHERE id = ?', (operacao['de'],))
+        elif operacao['op'] == 'lote':
+            db.executemany(
+                'INSERT OR REPLACE INTO producao (id, data, bordador_id, pedido, registro) VALUES (?, ?, ?, ?, ?)',
+                [self._linha(r) for r in operacao['registros']]
+            )
+            self._avancar_sequencia(operacao['registros'][-1]['id'] + 1)
+        else:
+            db.execute(
+                'INSERT OR REPLACE INTO producao (id, data, bordador_id, pedido, registro) VALUES (?, ?, ?, ?, ?)',
+                self._linha(operacao['registro'])
+            )
+            self._avancar_sequencia(operacao['registro']['id'] + 1)
+        seq = db.execute('INSERT INTO operacoes (operacao) VALUES (?)',
+                         (json_bytes(operacao).decode('utf-8'),)).lastrowid
+        db.execute("UPDATE meta SET valor = ? WHERE chave = 'versao'", (operacao['v'],))
+        if seq % 1000 == 0:
+            db.execute('DELETE FROM operacoes WHERE seq <= ?', (seq - self.LIMITE_OPERACOES,))
+        # Se outro worker gravou no meio, a próxima sincronização relê o trecho.
+        if seq == self._cursor + 1:
+            self._cursor = seq
+
+    def _gravar_tudo(self, registros):
+        db = self._conexao()
+        db.execute('DELETE FROM producao')
+        db.executemany(
+            'INSERT INTO producao (id, data, bordador_id, pedido, registro) VALUES (?, ?, ?, ?, ?)',
+            [self._linha(r) for r in registros]
+        )
+        db.execute('DELETE FROM nomes_bordador')
+        db.executemany('INSERT INTO nomes_bordador (id, nome) VALUES (?, ?)', list(self._bordadores.nomes.items()))
+        db.execute('DELETE FROM operacoes')
+        self._avancar_sequencia(self._proximo_id)
+        db.execute("UPDATE meta SET valor = ? WHERE chave = 'versao'", (self._versao,))
+        # os outros workers veem a geração nova e recarregam tudo
+        db.execute("UPDATE meta SET valor = CAST(valor AS INTEGER) + 1 WHERE chave = 'geracao'")
+        self._geracao = db.execute("SELECT valor FROM meta WHERE chave = 'geracao'").fetchone()[0]
+        linha = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'operacoes'").fetchone()
+        self._cursor = linha[0] if linha else 0
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            linhas = self._conexao().execute(sql, parametros).fetchall()
+            # o dicionário em memória já foi sincronizado por quem chamou
+            return [self._decodificar(json_ler(r)) for (r,) in linhas]
+
+    def _condicoes(self, bordador=None, data_inicio=None, data_fim=None):
+        condicoes, parametros = [], []
+        if bordador:
+            condicoes.append('bordador_id = ?')
+            parametros.append(self._codigo_bordador(bordador))
+        if data_inicio and data_fim:
+            condicoes.append("data <> '' AND data BETWEEN ? AND ?")
+            parametros += [data_inicio, data_fim]
+        return condicoes, parametros
+
+    def filtrar(self, bordador=None, data_inicio=None, data_fim=None):
+        with self._lock:
+            self.sincronizar()
+            condicoes, parametros = self._condicoes(bordador, data_inicio, data_fim)
+            where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+            return self._consultar(f'SELECT registro FROM producao {where} ORDER BY id', parametros)
+
+    def pagina(self, bordador=None, data_inicio=None, data_fim=None, apos=None, limite=None):
+        with self._lock:
+            self.sincronizar()
+            condicoes, parametros = self._condicoes(bordador, data_inicio, data_fim)
+            where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+            total = self._conexao().execute(f'SELECT COUNT(*) FROM producao {where}', parametros).fetchone()[0]
+        if apos is not None:
+            condicoes.append('id > ?')
+            parametros.append(apos)
+            where = f"WHERE {' AND '.join(condicoes)}"
+        sql = f'SELECT registro FROM producao {where} ORDER BY id'
+        if limite is not None:
+            sql += ' LIMIT ?'
+            parametros.append(limite + 1)
+        registros = self._consultar(sql, parametros)
+        proximo = None
+        if limite is not None and len(registros) > limite:
+            registros = registros[:limite]
+            proximo = registros[-1]['id'] if registros else None
+        return registros, total, proximo
+
+    def por_pedido(self, pedido_id):
+        with self._lock:
+            self.sincronizar()
+            return self._consultar('SELECT registro FROM producao WHERE pedido = ? ORDER BY id', (pedido_id,))
+
+    def carregar_bordadores(self):
+        with self._lock:
+            return [n for (n,) in self._conexao().execute('SELECT nome FROM bordadores ORDER BY posicao')]
+
+    def salvar_bordadores(self, bordadores):
+        with self._lock:
+            db = self._conexao()
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('DELETE FROM bordadores')
+            db.executemany('INSERT OR IGNORE INTO bordadores (nome) VALUES (?)', [(b,) for b in bordadores])
+            db.execute('COMMIT')
+
+    def carregar_usuarios(self):
+        with self._lock:
+            linhas = self._conexao().execute(
+                'SELECT username, senha, tipo, nome FROM usuarios ORDER BY rowid'
+            ).fetchall()
+        return {u: {'senha': s, 'tipo': t, 'nome': n} for u, s, t, n in linhas}
+
+    def salvar_usuarios(self, usuarios):
+        with self._lock:
+            db = self._conexao()
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('DELETE FROM usuarios')
+            db.executemany(
+                'INSERT INTO usuarios (username, senha, tipo, nome) VALUES (?, ?, ?, ?)',
+                [(u, d['senha'], d['tipo'], d['nome']) for u, d in usuarios.items()]
+            )
+            db.execute(
+                "INSERT INTO meta (chave, valor) VALUES ('versao_usuarios', 1) "
+                "ON CONFLICT(chave) DO UPDATE SET valor = CAST(valor AS INTEGER) + 1"
+            )
+            db.execute('COMMIT')
+
+    def versao_usuarios(self):
+        """Muda a cada gravação de usuários, em qualquer worker."""
+        with self._lock:
+            linha = self._conexao().execute("SELECT valor FROM meta WHERE chave = 'versao_usuarios'").fetchone()
+        return linha[0] if linha else None
+
+
+class ResumoArquivo:
+    """O que as consultas precisam do histórico arquivado, sem abrir as partições.
+
+    Montado do `resumo.json.gz` de `ArquivoProducao`: as células (bordador,
+    Data) de todos os meses num só `AgregadosDiarios`, o `PrefixosPedidos`
+    das sugestões, os meses de cada pedido e de cada bordador, e a marca
+    (tamanho, mtime) de cada partição que o resumo cobre.
+    """
+
+    def __init__(self, meses):
+        self.marcas = {mes: entrada['marca'] for mes, entrada in meses.items()}
+        self.agregados = AgregadosDiarios()
+        self.prefixos = PrefixosPedidos()
+        self.pedidos = {}
+        self.bordadores = {}
+        for mes, entrada in sorted(meses.items()):
+            self.agregados.adicionar_celulas(entrada['celulas'])
+            self.prefixos.somar(({'ID': pedido, 'FOLHA': folha}, quantos)
+                                for pedido, folha, quantos in entrada['pedidos'])
+            for bordador, _, _ in entrada['celulas']:
+                self.bordadores.setdefault(bordador, set()).add(mes)
+            for pedido, _, _ in entrada['pedidos']:
+                if pedido is not None:
+                    self.pedidos.setdefault(pedido, set()).add(mes)
+
+    @staticmethod
+    def resumir(registros, marca):
+        """Entrada do resumo de uma partição: células e pares (pedido, FOLHA) com a contagem."""
+        agregados = AgregadosDiarios()
+        agregados.reconstruir(registros)
+        pedidos = {}
+        for registro in registros:
+            pedido = registro.get('ID')
+            chave = (None if pedido is None else str(pedido), str(registro.get('FOLHA') or ''))
+            pedidos[chave] = pedidos.get(chave, 0) + 1
+        return {
+            'marca': marca,
+            'celulas': [[bordador, dia, soma] for bordador, dia, soma in agregados.todas_celulas()],
+            'pedidos': [[pedido, folha, quantos] for (pedido, folha), quantos in pedidos.items()]
+        }
+
+
+class ArquivoProducao:
+    """Histórico dos registros exportados, particionado por mês, em arquivos somente leitura.
+
+    Cada mês da Data é um arquivo `producao_AAAA-MM.json.gz` (registros sem data
+    válida ficam em `producao_sem-data.json.gz`) com os registros como eram ao
+    sair do armazém. Como lá, 'Bordador' é o id da `TabelaBordadores`; o nome
+    vem do dicionário do armazém (`nomes()`), então renomear não separa o
+    histórico. Só a fusão de dois bordadores (`renomear_bordador`) regrava
+    as partições. Arquivar de novo um mês regrava a partição (compactada,
+    com os registros antigos e os novos) e volta a deixá-la somente
+    leitura; nada é apagado.
+
+    Junto das partições fica `resumo.json.gz`, regravado a cada
+    arquivamento: por mês, as células (bordador, Data) e os pedidos, com a
+    marca da partição de que saíram. Totais, ranking e série saem só dele
+    (`ResumoArquivo`); registros (filtros, busca de pedido) abrem apenas os
+    meses do período que têm o bordador ou o pedido, e nenhum se o pedido
+    não está no histórico. Uma partição cuja marca não confere com a do
+    resumo (arquivamento interrompido, resumo ausente) é resumida de novo.
+    Cada worker guarda o resumo e as últimas partições lidas (registros e
+    `ResumoPedidos`), relidos quando o arquivo muda.
+    """
+
+    SEM_DATA = 'sem-data'
+    PARTICAO = re.compile(r'producao_(\d{4}-\d{2}|sem-data)\.json\.gz$')
+
+    def __init__(self, diretorio, maximo_em_cache, nomes=dict):
+        self.diretorio = diretorio
+        self.maximo_em_cache = maximo_em_cache
+        self.nomes = nomes
+        self.caminho_resumo = os.path.join(diretorio, 'resumo.json.gz')
+        self._lock = threading.Lock()
+        # arquivar e refazer o resumo gravam os mesmos arquivos (e o mesmo .tmp)
+        self._gravando = threading.Lock()
+        self._cache = OrderedDict()
+        self._resumo_atual = None
+
+    @staticmethod
+    def _nome(nomes, codigo):
+        return nomes.get(codigo, codigo) if isinstance(codigo, int) else codigo
+
+    def _codigo(self, nomes, bordador):
+        """Id do bordador para os filtros (o próprio nome se não está no dicionário)."""
+        if not bordador:
+            return None
+        return next((codigo for codigo, nome in nomes.items() if nome == bordador), bordador)
+
+    def _caminho(self, mes):
+        return os.path.join(self.diretorio, f'producao_{mes}.json.gz')
+
+    @classmethod
+    def mes(cls, registro):
+        data = str(registro.get('Data') or '')
+        return data[:7] if re.match(r'\d{4}-\d{2}-\d{2}', data) else cls.SEM_DATA
+
+    def meses(self):
+        """Meses (AAAA-MM) com partição arquivada, em ordem."""
+        return sorted(mes for mes in self._marcas() if mes != self.SEM_DATA)
+
+    def _marcas(self):
+        """{mês: [tamanho, mtime]} de cada partição em disco (um listdir e um stat por mês)."""
+        try:
+            nomes = os.listdir(self.diretorio)
+        except FileNotFoundError:
+            return {}
+        marcas = {}
+        for m in filter(None, map(self.PARTICAO.match, nomes)):
+            try:
+                estado = os.stat(self._caminho(m.group(1)))
+            except FileNotFoundError:
+                continue
+            marcas[m.group(1)] = [estado.st_size, estado.st_mtime_ns]
+        return marcas
+
+    def _ler(self, mes):
+        try:
+            with open(self._caminho(mes), 'rb') as f:
+                return json_ler(gzip.decompress(f.read()))['registros']
+        except FileNotFoundError:
+            return []
+
+    def _ler_resumo(self):
+        try:
+            with open(self.caminho_resumo, 'rb') as f:
+                return json_ler(gzip.decompress(f.read()))['meses']
+        except (FileNotFoundError, ValueError, OSError, KeyError):
+            return {}
+
+    def _gravar_resumo(self, meses):
+        gravar_arquivo_atomico(self.caminho_resumo, gzip.compress(json_bytes({'meses': meses})))
+
+    def _gravar(self, mes, registros):
+        """Grava a partição do mês e devolve a entrada dela no resumo."""
+        caminho = self._caminho(mes)
+        registros = sorted(registros, key=lambda r: r['id'])
+        gravar_arquivo_atomico(caminho, gzip.compress(json_bytes({'mes': mes, 'registros': registros})))
+        os.chmod(caminho, 0o444)
+        estado = os.stat(caminho)
+        return ResumoArquivo.resumir(registros, [estado.st_size, estado.st_mtime_ns])
+
+    def arquivar(self, registros):
+        """Junta os registros (com o id do bordador) às partições dos seus meses (o mesmo id é substituído)."""
+        por_mes = {}
+        for registro in registros:
+            por_mes.setdefault(self.mes(registro), []).append(registro)
+        os.makedirs(self.diretorio, exist_ok=True)
+        with self._gravando:
+            resumo = self._ler_resumo()
+            for mes, novos in por_mes.items():
+                juntos = {r['id']: r for r in self._ler(mes)}
+                juntos.update((r['id'], r) for r in novos)
+                resumo[mes] = self._gravar(mes, juntos.values())
+            self._gravar_resumo(resumo)
+
+    def renomear_bordador(self, de, para):
+        """Passa os registros arquivados do bordador `de` para `para` (fusão de bordadores).
+
+        O id `de` sai do dicionário e pode ser reaproveitado por um bordador
+        novo; por isso, ao contrário da renomeação simples, a fusão regrava
+        as partições que o têm. Chamado com o lock de escrita do armazém.
+        """
+        meses = self._resumo().bordadores.get(de)
+        if not meses:
+            return
+        with self._gravando:
+            resumo = self._ler_resumo()
+            for mes in sorted(meses):
+                registros = self._ler(mes)
+                resumo[mes] = self._gravar(
+                    mes, [{**r, 'Bordador': para} if r.get('Bordador') == de else r for r in registros]
+                )
+            self._gravar_resumo(resumo)
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+    def _resumo(self):
+        """`ResumoArquivo` das partições em disco, do cache enquanto as marcas conferem."""
+        marcas = self._marcas()
+        with self._lock:
+            if self._resumo_atual is not None and self._resumo_atual.marcas == marcas:
+                return self._resumo_atual
+        salvo = self._ler_resumo()
+        meses = {mes: salvo[mes] for mes, marca in marcas.items() if mes in salvo and salvo[mes]['marca'] == marca}
+        refazer = [mes for mes in marcas if mes not in meses]
+        for mes in refazer:
+            # a marca é lida antes do conteúdo: se a partição mudar no meio, a
+            # próxima consulta vê a diferença e resume de novo
+            meses[mes] = ResumoArquivo.resumir(self._ler(mes), marcas[mes])
+        if refazer or len(meses) != len(salvo):
+            app.logger.info(f"[arquivo] resumo refeito para {len(refazer)} partições")
+            with self._gravando:
+                self._gravar_resumo(meses)
+        resumo = ResumoArquivo(meses)
+        with self._lock:
+            self._resumo_atual = resumo
+        return resumo
 
-# Rotas de Botões 
+    def _particao(self, mes):
+        """(registros, pedidos) do mês, do cache enquanto o arquivo não mudar."""
+        caminho = self._caminho(mes)
+        try:
+            estado = os.stat(caminho)
+        except FileNotFoundError:
+            return [], ResumoPedidos()
+        marca = (estado.st_mtime_ns, estado.st_size)
+        with self._lock:
+            guardada = self._cache.get(mes)
+            if guardada is not None and guardada[0] == marca:
+                self._cache.move_to_end(mes)
+                return guardada[1:]
+        registros = self._ler(mes)
+        pedidos = ResumoPedidos()
+        pedidos.reconstruir(registros)
+        with self._lock:
+            self._cache[mes] = (marca, registros, pedidos)
+            self._cache.move_to_end(mes)
+            while len(self._cache) > self.maximo_em_cache:
+                self._cache.popitem(last=False)
+        return registros, pedidos
 
-@app.route('/gerenciamento')
-def gerenciamento():
-    return render_template('gerenciamento.html')  # ou 'gerenciamento.html' se for outro arquivo
+    def _meses_do_periodo(self, resumo, data_inicio, data_fim, codigo=None, pedido=None):
+        """Meses do resumo que o período cobre (sem período, todos, com a partição
+        sem data) e, com `codigo` e/ou `pedido`, em que o bordador e o pedido aparecem."""
+        meses = set(resumo.marcas)
+        if codigo is not None:
+            meses &= resumo.bordadores.get(codigo, set())
+        if pedido:
+            meses &= resumo.pedidos.get(pedido, set())
+        if not (data_inicio and data_fim):
+            return sorted(meses)
+        return sorted(m for m in meses if m != self.SEM_DATA and data_inicio[:7] <= m <= data_fim[:7])
 
-@app.route('/pesquisa')
-def pesquisa():
-    return render_template('pesquisa.html')
+    def filtrar(self, bordador=None, data_inicio=None, data_fim=None, pedido=None):
+        """Registros arquivados do período, do bordador e do pedido (cada filtro é
+        opcional), em ordem de id, com o nome do bordador e marcados com 'arquivado'."""
+        nomes = self.nomes()
+        codigo = self._codigo(nomes, bordador)
+        periodo = data_inicio and data_fim
+        encontrados = []
+        for mes in self._meses_do_periodo(self._resumo(), data_inicio, data_fim, codigo, pedido):
+            registros, _ = self._particao(mes)
+            encontrados.extend(
+                {**r, 'Bordador': self._nome(nomes, r.get('Bordador')), 'arquivado': True} for r in registros
+                if (not periodo or data_inicio <= str(r.get('Data') or '') <= data_fim)
+                and (not bordador or r.get('Bordador') == codigo)
+                and (not pedido or str(r.get('ID')) == pedido)
+            )
+        return sorted(encontrados, key=lambda r: r['id'])
+
+    def prefixos(self):
+        """`PrefixosPedidos` dos pedidos arquivados, para as sugestões da pesquisa."""
+        return self._resumo().prefixos
+
+    def totais(self, bordador, data_inicio, data_fim):
+        """Registros, peças e pontos arquivados do período, das células do resumo."""
+        return self._resumo().agregados.totais(self._codigo(self.nomes(), bordador), data_inicio, data_fim)
+
+    def por_bordador(self, data_inicio=None, data_fim=None):
+        """{bordador: [registros, peças, pontos]} arquivados no período (sem período, tudo)."""
+        nomes = self.nomes()
+        soma = {}
+        for codigo, valores in self._resumo().agregados.por_bordador(data_inicio, data_fim):
+            atual = soma.setdefault(self._nome(nomes, codigo), [0, 0, 0])
+            for i, valor in enumerate(valores):
+                atual[i] += valor
+        return soma
+
+    def celulas(self, bordador=None, data_inicio=None, data_fim=None):
+        """[(bordador, Data, [registros, peças, pontos])] arquivados, por dia, no período."""
+        nomes = self.nomes()
+        codigo = self._codigo(nomes, bordador)
+        return [(self._nome(nomes, c), dia, soma)
+                for c, dia, soma in self._resumo().agregados.celulas(codigo, data_inicio, data_fim)]
+
+    def por_pedido(self, pedido_id):
+        """Registros arquivados do pedido, em ordem de id (com o nome do bordador).
+
+        Abre só as partições dos meses em que o resumo tem o pedido.
+        """
+        meses = self._resumo().pedidos.get(pedido_id)
+        if not meses:
+            return []
+        nomes = self.nomes()
+        encontrados = []
+        for mes in sorted(meses):
+            registros, pedidos = self._particao(mes)
+            pedido = pedidos.pedidos.get(pedido_id)
+            if pedido:
+                encontrados.extend({**r, 'Bordador': self._nome(nomes, r.get('Bordador'))}
+                                   for r in registros if r['id'] in pedido['ids'])
+        return sorted(encontrados, key=lambda r: r['id'])
+
+
+class VersaoDados:
+    """Número de versão dos dados, num arquivo lido por todos os workers.
+
+    Toda alteração de registros, bordadores ou usuários o incrementa, depois
+    de gravada. O arquivo guarda também o horário da última alteração
+    (Last-Modified), uma marca aleatória criada com ele, para que um arquivo
+    recriado não repita ETags antigas, e um segundo contador só das alterações
+    de bordadores e usuários (cadastros).
+    """
+
+    TAMANHO = 64
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def _descritor(self):
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.caminho, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    @contextmanager
+    def _travado(self, modo):
+        # o flock é do descritor, compartilhado pelas threads: elas fazem fila no _lock
+        with self._lock:
+            fd = self._descritor()
+            if fcntl is not None:
+                fcntl.flock(fd, modo)
+            try:
+                yield fd
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _ler(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        campos = os.read(fd, self.TAMANHO).split()
+        if len(campos) not in (3, 4):
+            return 0, 0.0, None, 0
+        cadastros = int(campos[3]) if len(campos) == 4 else 0
+        return int(campos[0]), float(campos[1]), campos[2].decode('ascii'), cadastros
+
+    def estado(self):
+        """(versão, horário da última alteração, marca do arquivo, versão dos cadastros)."""
+        with self._travado(fcntl.LOCK_SH if fcntl is not None else None) as fd:
+            versao, alterado_em, marca, cadastros = self._ler(fd)
+        return versao, alterado_em, marca or '0', cadastros
+
+    def atual(self):
+        """(versão, horário da última alteração, marca do arquivo)."""
+        return self.estado()[:3]
+
+    def incrementar(self, cadastro=False):
+        with self._travado(fcntl.LOCK_EX if fcntl is not None else None) as fd:
+            versao, _, marca, cadastros = self._ler(fd)
+            cadastros += 1 if cadastro else 0
+            conteudo = f"{versao + 1} {time.time():.6f} {marca or secrets.token_hex(4)} {cadastros}"
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, conteudo.ljust(self.TAMANHO).encode('ascii'))
+        return versao + 1
+
+
+if STORAGE_BACKEND == 'sqlite':
+    armazem = ArmazemSQLite(SQLITE_FILE)
+else:
+    armazem = ArmazemJSON(DATA_FILE, JOURNAL_FILE, JOURNAL_LIMITE_BYTES)
+versao_dados = VersaoDados(VERSION_FILE)
+armazem.ouvintes.append(versao_dados.incrementar)
+arquivo_producao = ArquivoProducao(ARQUIVO_DIR, ARQUIVO_CACHE_PARTICOES, armazem.nomes_bordadores)
+
+
+class CentralEventos:
+    """Distribui os eventos do armazém para as conexões abertas em /api/stream.
+
+    Cada conexão tem uma fila e todas esperam na mesma Condition: publicar é
+    anexar o evento às filas e acordar quem espera, sem thread por cliente.
+    Escritas de outros workers só aparecem quando este sincroniza; a conexão
+    que acorda sem eventos confere a versão dos dados (no máximo uma vez por
+    `intervalo` no worker) e sincroniza o armazém, o que publica os eventos.
+    """
+
+    def __init__(self, armazem, versao, maximo, intervalo, tamanho_fila):
+        self.armazem = armazem
+        self.versao = versao
+        self.maximo = maximo
+        self.intervalo = intervalo
+        self.tamanho_fila = tamanho_fila
+        self._cond = threading.Condition()
+        self._filas = []
+        self._visto = None  # (versão, versão dos cadastros) na última verificação
+        self._verificado_em = 0.0
+
+    def publicar(self, evento):
+        with self._cond:
+            if not self._filas:
+                return
+            for fila in self._filas:
+                if len(fila) >= self.tamanho_fila:
+                    # conexão que não acompanha: descarta a fila e pede uma recarga
+                    fila.clear()
+                    fila.append({'tipo': 'recarregar'})
+                elif not fila or fila[-1]['tipo'] != 'recarregar':
+                    fila.append(evento)
+            self._cond.notify_all()
+
+    def assinar(self):
+        """Fila nova para uma conexão, ou None se o worker já está no limite."""
+        with self._cond:
+            if len(self._filas) >= self.maximo:
+                return None
+            fila = deque()
+            self._filas.append(fila)
+        # a primeira conexão do worker marca a versão de referência já na entrada
+        self._verificar()
+        return fila
+
+    def cancelar(self, fila):
+        with self._cond:
+            if any(f is fila for f in self._filas):
+                self._filas = [f for f in self._filas if f is not fila]
+
+    def aguardar(self, fila, tempo):
+        """Eventos da fila, esperando até `tempo` segundos (lista vazia se nada veio)."""
+        limite = time.monotonic() + tempo
+        while True:
+            with self._cond:
+                if not fila:
+                    self._cond.wait(max(0, min(self.intervalo, limite - time.monotonic())))
+                if fila:
+                    eventos = list(fila)
+                    fila.clear()
+                    return eventos
+            if time.monotonic() >= limite:
+                return []
+            self._verificar()
+
+    def _verificar(self):
+        with self._cond:
+            agora = time.monotonic()
+            if agora - self._verificado_em < self.intervalo:
+                return
+            self._verificado_em = agora
+            visto = self._visto
+        versao, _, _, cadastros = self.versao.estado()
+        if (versao, cadastros) == visto:
+            return
+        # sem o lock da Condition: sincronizar pega o lock do armazém e publica
+        self.armazem.sincronizar()
+        self._visto = (versao, cadastros)
+        if visto is not None and cadastros != visto[1]:
+            # lista de bordadores (ou usuários) alterada, fora das operações dos registros
+            self.publicar({'tipo': 'bordador'})
+
+
+central_eventos = CentralEventos(armazem, versao_dados, SSE_MAX_CONEXOES,
+                                 SSE_VERIFICAR_SEGUNDOS, SSE_FILA_MAX)
+armazem.observadores.append(central_eventos.publicar)
+
+
+@app.cli.command('migrar-sqlite')
+def migrar_sqlite():
+    """Cria o banco SQLite a partir dos arquivos JSON (executado uma única vez)."""
+    ArmazemSQLite(SQLITE_FILE).sincronizar()
+    print(f'Banco {SQLITE_FILE} pronto.')
+
+
+@app.cli.command('verificar-agregados')
+def verificar_agregados():
+    """Confere os agregados de estatísticas contra os registros (e os reconstrói se preciso)."""
+    print('Agregados consistentes.' if armazem.verificar_agregados() else 'Agregados reconstruídos.')
 
 
 # Funções auxiliares
 def carregar_dados():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+    return armazem.registros()
 
 def salvar_dados(dados):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(dados, f, ensure_ascii=False, indent=2)
+    armazem.substituir(dados)
 
 def carregar_bordadores():
+    if STORAGE_BACKEND == 'sqlite':
+        return armazem.carregar_bordadores()
     if os.path.exists(BORDADORES_FILE):
         with open(BORDADORES_FILE, 'r', encoding='utf-8') as f:
             return json.load(f)
     return ['João Silva', 'Maria Santos', 'Pedro Oliveira', 'Ana Costa']
 
 def salvar_bordadores(bordadores):
-    with open(BORDADORES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(bordadores, f, ensure_ascii=False, indent=2)
+    if STORAGE_BACKEND == 'sqlite':
+        armazem.salvar_bordadores(bordadores)
+    else:
+        gravar_arquivo_atomico(BORDADORES_FILE, json.dumps(bordadores, ensure_ascii=False, indent=2))
+    versao_dados.incrementar(cadastro=True)
 
 def carregar_usuarios():
-    if os.path.exists(USERS_FILE):
+    if STORAGE_BACKEND == 'sqlite':
+        usuarios = armazem.carregar_usuarios()
+        if usuarios:
+            return usuarios
+    elif os.path.exists(USERS_FILE):
         with open(USERS_FILE, 'r', encoding='utf-8') as f:
             return json.load(f)
     # Usuários padrão
@@ -74,31 +3070,200 @@ def carregar_usuarios():
     return usuarios
 
 def salvar_usuarios(usuarios):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(usuarios, f, ensure_ascii=False, indent=2)
+    if STORAGE_BACKEND == 'sqlite':
+        armazem.salvar_usuarios(usuarios)
+    else:
+        gravar_arquivo_atomico(USERS_FILE, json.dumps(usuarios, ensure_ascii=False, indent=2))
+    invalidar_usuarios()
+    versao_dados.incrementar(cadastro=True)
+
+# Cache de usuários e sessões
+_usuarios_cache = {'assinatura': None, 'usuarios': None}
+_usuarios_cache_lock = threading.RLock()
+# o scrypt gasta CPU e memória de propósito: poucos ao mesmo tempo por worker
+_vagas_login = threading.BoundedSemaphore(LOGIN_SIMULTANEOS)
+serializador_tokens = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='sessao')
+ROTAS_PUBLICAS = {'/api/login'}
+
+def assinatura_usuarios():
+    """Muda quando qualquer worker grava os usuários."""
+    if STORAGE_BACKEND == 'sqlite':
+        return armazem.versao_usuarios()
+    try:
+        st = os.stat(USERS_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def usuarios_em_cache():
+    """Usuários para o login e a conferência dos tokens (somente leitura)."""
+    assinatura = assinatura_usuarios()
+    with _usuarios_cache_lock:
+        if _usuarios_cache['usuarios'] is None or _usuarios_cache['assinatura'] != assinatura:
+            _usuarios_cache['usuarios'] = carregar_usuarios()
+            _usuarios_cache['assinatura'] = assinatura_usuarios()
+        return _usuarios_cache['usuarios']
+
+def invalidar_usuarios():
+    with _usuarios_cache_lock:
+        _usuarios_cache['usuarios'] = None
+
+def marca_senha(hash_senha):
+    # entra no token: trocar a senha invalida as sessões abertas
+    return hashlib.sha256(hash_senha.encode('utf-8')).hexdigest()[:16]
+
+def emitir_token(username, usuario):
+    return serializador_tokens.dumps({'u': username, 's': marca_senha(usuario['senha'])})
+
+def usuario_do_token(token):
+    """Usuário da sessão, ou None se o token for inválido, expirado ou de senha antiga."""
+    try:
+        dados = serializador_tokens.loads(token, max_age=TOKEN_VALIDADE_HORAS * 3600)
+    except BadSignature:
+        return None
+    usuario = usuarios_em_cache().get(dados.get('u'))
+    if usuario is None or marca_senha(usuario['senha']) != dados.get('s'):
+        return None
+    return {'username': dados['u'], 'tipo': usuario['tipo'], 'nome': usuario['nome']}
+
+@app.before_request
+def verificar_sessao():
+    """Toda rota /api/* (menos o login) exige o token emitido no login."""
+    if not request.path.startswith('/api/') or request.path in ROTAS_PUBLICAS or request.method == 'OPTIONS':
+        return None
+    cabecalho = request.headers.get('Authorization', '')
+    # downloads e EventSource não mandam cabeçalho: aceitam ?token=
+    token = cabecalho[7:] if cabecalho.startswith('Bearer ') else request.args.get('token')
+    usuario = usuario_do_token(token) if token else None
+    if usuario is None:
+        return jsonify({'success': False, 'message': 'Sessão expirada ou inválida'}), 401
+    g.usuario = usuario
+
+def somente_gerente(rota):
+    @wraps(rota)
+    def verificada(*args, **kwargs):
+        if g.usuario['tipo'] != 'gerente':
+            return jsonify({'success': False, 'message': 'Acesso restrito ao gerente'}), 403
+        return rota(*args, **kwargs)
+    return verificada
+
+# GET condicional (ETag / Last-Modified) e cache das respostas
+_respostas = OrderedDict()
+_respostas_lock = threading.Lock()
+CABECALHOS_EM_CACHE = ('Content-Type', 'X-Total-Count', 'X-Proximo-Cursor', 'X-Versao')
+
+def resposta_condicional(rota):
+    """ETag e Last-Modified pela versão dos dados, com 304 e cache por (rota, args, versão).
+
+    A versão é lida antes da rota: um 304 ou uma resposta em cache não tocam
+    no armazenamento nem serializam nada. Só respostas 200 que não são
+    enviadas em partes (stream) entram no cache.
+    """
+    @wraps(rota)
+    def condicional(*args, **kwargs):
+        versao, alterado_em, marca = versao_dados.atual()
+        etag = f'{marca}-{versao}'
+        modificado = datetime.utcfromtimestamp(int(alterado_em)) if alterado_em else None
+        if request.if_none_match:
+            nao_mudou = request.if_none_match.contains_weak(etag)
+        else:
+            nao_mudou = bool(modificado and request.if_modified_since
+                             and modificado <= request.if_modified_since.replace(tzinfo=None))
+        if nao_mudou:
+            response = Response(status=304)
+        else:
+            # o token de sessão não muda a resposta
+            argumentos = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k != 'token'))
+            chave = (request.path, argumentos)
+            with _respostas_lock:
+                guardada = _respostas.get(chave)
+                if guardada is not None and guardada[0] == etag:
+                    _respostas.move_to_end(chave)
+            if guardada is not None and guardada[0] == etag:
+                response = Response(guardada[1], headers=guardada[2])
+            else:
+                response = app.make_response(rota(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    cabecalhos = [(k, v) for k, v in response.headers.items() if k in CABECALHOS_EM_CACHE]
+                    with _respostas_lock:
+                        _respostas[chave] = (etag, response.get_data(), cabecalhos)
+                        _respostas.move_to_end(chave)
+                        while len(_respostas) > CACHE_RESPOSTAS_MAX:
+                            _respostas.popitem(last=False)
+        if response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            if modificado:
+                response.last_modified = modificado
+            # o navegador sempre revalida: a versão muda a qualquer momento
+            response.cache_control.no_cache = True
+        return response
+    return condicional
+
+# Compressão das respostas
+TIPOS_COMPRIMIDOS = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+def gzip_em_partes(partes):
+    compressor = zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)  # wbits 31: formato gzip
+    for parte in partes:
+        dados = compressor.compress(parte.encode('utf-8') if isinstance(parte, str) else parte)
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+@app.after_request
+def comprimir_resposta(response):
+    """gzip para respostas grandes (ou em partes) quando o cliente aceita."""
+    if response.mimetype not in TIPOS_COMPRIMIDOS or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or request.accept_encodings['gzip'] <= 0):
+        return response
+    if response.is_streamed:
+        # tamanho desconhecido: as rotas só mandam em partes as listas grandes
+        response.response = gzip_em_partes(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        dados = response.get_data()
+        if len(dados) < GZIP_MIN_BYTES:
+            return response
+        response.set_data(gzip.compress(dados, GZIP_NIVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 # Rotas de Autenticação
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.json
-    usuarios = carregar_usuarios()
+    usuarios = usuarios_em_cache()
     
     username = data.get('username')
     senha = data.get('senha')
     
-    if username in usuarios and check_password_hash(usuarios[username]['senha'], senha):
-        return jsonify({
-            'success': True,
-            'tipo': usuarios[username]['tipo'],
-            'nome': usuarios[username]['nome'],
-            'username': username
-        })
+    if username in usuarios and senha:
+        if not _vagas_login.acquire(timeout=LOGIN_ESPERA_SEGUNDOS):
+            response = jsonify({'success': False, 'message': 'Muitos acessos ao mesmo tempo. Tente novamente.'})
+            response.headers['Retry-After'] = '2'
+            return response, 503
+        try:
+            valida = check_password_hash(usuarios[username]['senha'], senha)
+        finally:
+            _vagas_login.release()
+        if valida:
+            return jsonify({
+                'success': True,
+                'tipo': usuarios[username]['tipo'],
+                'nome': usuarios[username]['nome'],
+                'username': username,
+                'token': emitir_token(username, usuarios[username])
+            })
     
     return jsonify({'success': False, 'message': 'Credenciais inválidas'}), 401
 
 
 # Rotas de Bordadores
 @app.route('/api/bordadores', methods=['GET'])
+@resposta_condicional
 def get_bordadores():
     return jsonify(carregar_bordadores())
 
@@ -137,19 +3302,18 @@ def update_bordador(nome):
     bordadores[index] = novo_nome
     salvar_bordadores(bordadores)
     
-    # Atualizar também nos registros de produção
-    dados = carregar_dados()
-    for registro in dados:
-        if registro.get('Bordador') == nome:
-            registro['Bordador'] = novo_nome
-    salvar_dados(dados)
+    # Atualizar também nos registros de produção (só o dicionário de nomes muda)
+    armazem.renomear_bordador(nome, novo_nome, arquivo_producao)
     
     # Atualizar também nos usuários (se houver usuário com esse nome)
     usuarios = carregar_usuarios()
+    alterado = False
     for username, user_data in usuarios.items():
         if user_data.get('nome') == nome:
             user_data['nome'] = novo_nome
-    salvar_usuarios(usuarios)
+            alterado = True
+    if alterado:
+        salvar_usuarios(usuarios)
     
     return jsonify({'success': True, 'bordadores': bordadores})
 
@@ -161,8 +3325,7 @@ def delete_bordador(nome):
         return jsonify({'success': False, 'message': 'Bordador não encontrado'}), 404
     
     # Verificar se há registros de produção para este bordador
-    dados = carregar_dados()
-    tem_registros = any(d.get('Bordador') == nome for d in dados)
+    tem_registros = armazem.referencias(nome) > 0
     
     if tem_registros:
         return jsonify({
@@ -176,16 +3339,135 @@ def delete_bordador(nome):
     
     return jsonify({'success': True, 'bordadores': bordadores})
 
+# Paginação e respostas em partes
+def parametros_paginacao(fonte):
+    """Lê `limit` e `cursor` (ou `after_id`) de um dict; ValueError se inválidos."""
+    limite = fonte.get('limit')
+    cursor = fonte.get('cursor', fonte.get('after_id'))
+    limite = int(limite) if limite not in (None, '') else None
+    cursor = int(cursor) if cursor not in (None, '') else None
+    if limite is not None and limite <= 0:
+        raise ValueError('limit deve ser positivo')
+    return limite, cursor
+
+def juntar_arquivados(dados, total, proximo, arquivados, cursor, limite):
+    """Junta à página do armazém os registros arquivados do mesmo filtro, em ordem de id.
+
+    A página do armazém já tem os `limite` primeiros ids depois do cursor;
+    os primeiros `limite` da junção com os arquivados são a página certa.
+    """
+    if not arquivados:
+        return dados, total, proximo
+    total += len(arquivados)
+    if cursor is not None:
+        arquivados = arquivados[bisect.bisect_right([r['id'] for r in arquivados], cursor):]
+    juntos = list(heapq.merge(dados, arquivados, key=lambda r: r['id']))
+    if limite is None or (len(juntos) <= limite and proximo is None):
+        return juntos, total, None
+    pagina = juntos[:limite]
+    return pagina, total, pagina[-1]['id'] if pagina else None
+
+def em_blocos(registros, tamanho=500):
+    """Agrupa um iterável de registros em listas de até `tamanho`."""
+    bloco = []
+    for registro in registros:
+        bloco.append(registro)
+        if len(bloco) == tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+def resposta_em_partes(blocos, prefixo='', sufixo=''):
+    """Resposta JSON cujo array de registros é serializado e enviado bloco a bloco.
+
+    `blocos` é um iterável de listas de registros (de `pagina_em_partes` ou
+    `em_blocos`): cada bloco só é montado quando vai ser enviado.
+    """
+    def gerar():
+        yield (prefixo + '[').encode('utf-8')
+        primeiro = True
+        for bloco in blocos:
+            if not bloco:
+                continue
+            # cada bloco é um array serializado de uma vez, sem os colchetes
+            yield (b'' if primeiro else b',') + json_bytes(bloco)[1:-1]
+            primeiro = False
+        yield (']' + sufixo).encode('utf-8')
+    return Response(stream_with_context(gerar()), mimetype='application/json')
+
+
+# Eventos ao vivo (Server-Sent Events)
+@app.route('/api/stream', methods=['GET'])
+def stream_eventos():
+    """Envia as mudanças (registro alterado + totais dos bordadores) enquanto a conexão durar.
+
+    Eventos: `conectado` (a conexão vai receber as mudanças), `producao`
+    (insert/update/delete/lote), `bordador` e `recarregar` (o conjunto foi
+    regravado; o cliente deve buscar tudo de novo). O EventSource não manda
+    cabeçalhos: o token vai em `?token=`.
+
+    Com o worker no limite de conexões, a resposta é um evento `ocupado` e o
+    fim do stream, com `retry:` de SSE_REPETIR_SEGUNDOS: um erro HTTP faria o
+    EventSource desistir de vez; assim ele reconecta sozinho e, até lá, o
+    cliente consulta /api/producao/changes.
+    """
+    fila = central_eventos.assinar()
+    if fila is None:
+        repetir = f"retry: {SSE_REPETIR_SEGUNDOS * 1000}\n" \
+                  f"event: ocupado\ndata: {json_bytes({'repetir': SSE_REPETIR_SEGUNDOS}).decode('utf-8')}\n\n"
+        response = Response(repetir, mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def gerar():
+        yield 'retry: 3000\nevent: conectado\ndata: {}\n\n'
+        while True:
+            eventos = central_eventos.aguardar(fila, SSE_HEARTBEAT_SEGUNDOS)
+            if not eventos:
+                # comentário: mantém a conexão viva e detecta cliente que saiu
+                yield ': ping\n\n'
+            for evento in eventos:
+                nome = evento['tipo'] if evento['tipo'] in ('bordador', 'recarregar') else 'producao'
+                yield f"event: {nome}\ndata: {json_bytes(evento).decode('utf-8')}\n\n"
+
+    response = Response(gerar(), mimetype='text/event-stream')
+    # o gerador pode nem começar (cliente que desiste cedo): a fila sai no close
+    response.call_on_close(lambda: central_eventos.cancelar(fila))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # Rotas de Produção
 @app.route('/api/producao', methods=['GET'])
+@resposta_condicional
 def get_producao():
-    dados = carregar_dados()
+    """Lista a produção; aceita `limit`, `cursor` (último id recebido) e `stream=1`.
+
+    O corpo continua sendo um array; total e próximo cursor vão nos cabeçalhos
+    X-Total-Count e X-Proximo-Cursor, e a versão dos dados (para
+    /api/producao/changes) em X-Versao.
+    """
     bordador = request.args.get('bordador')
+    try:
+        limite, cursor = parametros_paginacao(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Parâmetros de paginação inválidos'}), 400
     
-    if bordador:
-        dados = [d for d in dados if d.get('Bordador') == bordador]
-    
-    return jsonify(dados)
+    # a versão é lida antes da lista: no pior caso uma mudança vem de novo depois
+    versao = armazem.versao()
+    if request.args.get('stream'):
+        blocos, total, proximo = armazem.pagina_em_partes(bordador=bordador, apos=cursor, limite=limite)
+        response = resposta_em_partes(blocos)
+    else:
+        dados, total, proximo = armazem.pagina(bordador=bordador, apos=cursor, limite=limite)
+        response = jsonify(dados)
+    response.headers['X-Total-Count'] = str(total)
+    response.headers['X-Versao'] = str(versao)
+    if proximo is not None:
+        response.headers['X-Proximo-Cursor'] = str(proximo)
+    return response
 
 # Adicione esta nova rota no seu app.py, após a rota /api/producao
 
@@ -193,29 +3475,83 @@ def get_producao():
 def filtrar_producao():
     """Filtra produção por período de datas"""
     data = request.json
-    dados = carregar_dados()
     
     data_inicio = data.get('data_inicio')
     data_fim = data.get('data_fim')
     bordador = data.get('bordador')
+    try:
+        limite, cursor = parametros_paginacao(data)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Parâmetros de paginação inválidos'}), 400
+    
+    # Filtrar por bordador e/ou período se especificados (com o histórico arquivado)
+    versao = armazem.versao()
+    arquivados = arquivo_producao.filtrar(bordador, data_inicio, data_fim)
     
-    # Filtrar por bordador se especificado
-    if bordador:
-        dados = [d for d in dados if d.get('Bordador') == bordador]
+    if data.get('stream') or request.args.get('stream'):
+        blocos, total, proximo = armazem.pagina_em_partes(
+            bordador=bordador, data_inicio=data_inicio, data_fim=data_fim, apos=cursor, limite=limite
+        )
+        if arquivados and limite is None:
+            # sem limite, a página é tudo depois do cursor: junta as duas sequências em ordem de id
+            total += len(arquivados)
+            if cursor is not None:
+                arquivados = [r for r in arquivados if r['id'] > cursor]
+            blocos = em_blocos(heapq.merge(itertools.chain.from_iterable(blocos), arquivados, key=lambda r: r['id']))
+        elif arquivados:
+            # com limite, a página já é limitada: junta como na resposta comum
+            dados, total, proximo = juntar_arquivados(
+                [r for bloco in blocos for r in bloco], total, proximo, arquivados, cursor, limite
+            )
+            blocos = em_blocos(dados)
+        cabecalho = json_bytes({'success': True, 'total': total, 'proximo_cursor': proximo,
+                                'versao': versao}).decode('utf-8')
+        return resposta_em_partes(blocos, prefixo=cabecalho[:-1] + ', "dados": ', sufixo='}')
     
-    # Filtrar por período se especificado
-    if data_inicio and data_fim:
-        dados_filtrados = []
-        for d in dados:
-            data_registro = d.get('Data', '')
-            if data_registro and data_inicio <= data_registro <= data_fim:
-                dados_filtrados.append(d)
-        dados = dados_filtrados
+    dados, total, proximo = armazem.pagina(
+        bordador=bordador, data_inicio=data_inicio, data_fim=data_fim, apos=cursor, limite=limite
+    )
+    if arquivados:
+        dados, total, proximo = juntar_arquivados(dados, total, proximo, arquivados, cursor, limite)
     
     return jsonify({
         'success': True,
         'dados': dados,
-        'total': len(dados)
+        'total': total,
+        'proximo_cursor': proximo,
+        'versao': versao
+    })
+
+
+@app.route('/api/producao/changes', methods=['GET'])
+@resposta_condicional
+def mudancas_producao():
+    """Só o que mudou depois da versão `since` (de X-Versao, de `versao` ou de um evento).
+
+    Aceita `bordador`, `data_inicio` e `data_fim`; registros alterados que
+    saíram do filtro vêm em `removidos`, junto com os excluídos. Com
+    `resync: true` o histórico não cobre mais `since`: o cliente busca tudo.
+    """
+    try:
+        desde = int(request.args['since'])
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'Parâmetro since inválido'}), 400
+    
+    versao, registros, removidos = armazem.mudancas(
+        desde,
+        bordador=request.args.get('bordador'),
+        data_inicio=request.args.get('data_inicio'),
+        data_fim=request.args.get('data_fim')
+    )
+    if registros is None:
+        return jsonify({'success': True, 'versao': versao, 'resync': True})
+    
+    return jsonify({
+        'success': True,
+        'versao': versao,
+        'resync': False,
+        'registros': registros,
+        'removidos': removidos
     })
 
 
@@ -223,411 +3559,632 @@ def filtrar_producao():
 def filtrar_estatisticas():
     """Calcula estatísticas filtradas por período"""
     data = request.json
-    dados = carregar_dados()
     
     data_inicio = data.get('data_inicio')
     data_fim = data.get('data_fim')
     bordador = data.get('bordador')
     
-    # Filtrar por bordador se especificado
-    if bordador:
-        dados = [d for d in dados if d.get('Bordador') == bordador]
-    
-    # Filtrar por período se especificado
-    if data_inicio and data_fim:
-        dados_filtrados = []
-        for d in dados:
-            data_registro = d.get('Data', '')
-            if data_registro and data_inicio <= data_registro <= data_fim:
-                dados_filtrados.append(d)
-        dados = dados_filtrados
-    
-    total_registros = len(dados)
-    total_pecas = 0
-    total_pontos = 0
-    
-    for d in dados:
-        try:
-            qtd = int(''.join(filter(str.isdigit, str(d.get('QTD', '0')))))
-            total_pecas += qtd
-        except:
-            pass
-        
-        try:
-            pontos = int(''.join(filter(str.isdigit, str(d.get('PONTOS', '0')))))
-            total_pontos += pontos
-        except:
-            pass
+    # Filtrar por bordador e/ou período se especificados
+    totais = armazem.estatisticas(bordador=bordador, data_inicio=data_inicio, data_fim=data_fim)
+    for campo, valor in arquivo_producao.totais(bordador, data_inicio, data_fim).items():
+        totais[campo] += valor
     
     return jsonify({
         'success': True,
-        'total_registros': total_registros,
-        'total_pecas': total_pecas,
-        'total_pontos': total_pontos
+        **totais
     })
 
 @app.route('/api/producao', methods=['POST'])
 def add_producao():
     data = request.json
-    dados = carregar_dados()
+    erro = validar_pedido(data) if isinstance(data, dict) else 'Registro deve ser um objeto'
+    if erro:
+        return jsonify({'success': False, 'message': erro}), 400
     
     # Adicionar ID único e timestamp
-    novo_registro = {
-        'id': len(dados) + 1,
-        'timestamp': datetime.now().isoformat(),
-        **data
-    }
-    
-    dados.append(novo_registro)
-    salvar_dados(dados)
+    novo_registro = armazem.inserir(data)
     
     return jsonify({'success': True, 'registro': novo_registro})
 
+CAMPOS_OBRIGATORIOS = ('Data', 'Bordador', 'ID', 'FOLHA', 'QTD')
+
+def validar_pedido(dados):
+    """ID e FOLHA entram nos índices de pedidos: lista ou objeto não servem."""
+    for campo in ('ID', 'FOLHA'):
+        if isinstance(dados.get(campo), (list, dict)):
+            return f'{campo} deve ser um texto'
+    return None
+
+def validar_registro(dados):
+    """Mensagem de erro do registro de produção, ou None se ele estiver válido."""
+    if not isinstance(dados, dict):
+        return 'Registro deve ser um objeto'
+    faltando = [campo for campo in CAMPOS_OBRIGATORIOS if not str(dados.get(campo) or '').strip()]
+    if faltando:
+        return f"Campos obrigatórios ausentes: {', '.join(faltando)}"
+    erro = validar_pedido(dados)
+    if erro:
+        return erro
+    try:
+        data_ordinal(dados['Data'])
+    except ValueError:
+        return 'Data inválida (use AAAA-MM-DD)'
+    for campo in ('QTD', 'PONTOS'):
+        valor = dados.get(campo)
+        if valor not in (None, '') and not any(c.isdigit() for c in str(valor)):
+            return f'{campo} deve ser numérico'
+    return None
+
+@app.route('/api/producao/lote', methods=['POST'])
+def add_producao_lote():
+    """Inclui uma folha de pedido inteira (lista de registros) com uma única gravação.
+
+    Aceita a lista direto no corpo ou em `registros`. Itens inválidos não
+    impedem os demais: cada um volta em `erros` com o índice na lista.
+    """
+    data = request.get_json(silent=True)
+    itens = data.get('registros') if isinstance(data, dict) else data
+    if not isinstance(itens, list) or not itens:
+        return jsonify({'success': False, 'message': 'Envie uma lista de registros'}), 400
+    if len(itens) > LOTE_MAX_REGISTROS:
+        return jsonify({
+            'success': False,
+            'message': f'Máximo de {LOTE_MAX_REGISTROS} registros por lote'
+        }), 400
+    
+    validos, erros = [], []
+    for indice, item in enumerate(itens):
+        erro = validar_registro(item)
+        if erro:
+            erros.append({'indice': indice, 'message': erro})
+        else:
+            validos.append(indice)
+    
+    registros = armazem.inserir_lote([itens[i] for i in validos])
+    
+    return jsonify({
+        'success': bool(registros),
+        'inseridos': len(registros),
+        'registros': [{'indice': i, 'registro': r} for i, r in zip(validos, registros)],
+        'erros': erros
+    }), 200 if registros else 400
+
 @app.route('/api/producao/<int:id>', methods=['PUT'])
 def update_producao(id):
     data = request.json
-    dados = carregar_dados()
+    erro = validar_pedido(data) if isinstance(data, dict) else 'Registro deve ser um objeto'
+    if erro:
+        return jsonify({'success': False, 'message': erro}), 400
+    registro = armazem.atualizar(id, data)
     
-    for i, registro in enumerate(dados):
-        if registro.get('id') == id:
-            dados[i] = {**registro, **data, 'id': id}
-            salvar_dados(dados)
-            return jsonify({'success': True, 'registro': dados[i]})
+    if registro is not None:
+        return jsonify({'success': True, 'registro': registro})
     
     return jsonify({'success': False, 'message': 'Registro não encontrado'}), 404
 
 @app.route('/api/producao/<int:id>', methods=['DELETE'])
 def delete_producao(id):
-    dados = carregar_dados()
-    dados = [d for d in dados if d.get('id') != id]
-    salvar_dados(dados)
+    armazem.remover(id)
     return jsonify({'success': True})
     
 
 # Rota de Exportação
-@app.route('/api/exportar', methods=['POST'])
-def exportar_excel():
-    import zipfile
-    from io import BytesIO
-    import re
-    from datetime import datetime
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    import traceback
+COLUNAS_TECNICAS = ('id', 'timestamp')
 
-    try:
-        dados = carregar_dados()
-        app.logger.info(f"[exportar] registros encontrados: {len(dados)}")
+def sanitize_filename(name, max_len=100):
+    if not name:
+        name = "sem_nome"
+    name = str(name)
+    name = re.sub(r'[<>:"/\\|?*\n\r\t]', '_', name)
+    name = re.sub(r'[\. ]+$', '', name)
+    return name[:max_len]
 
-        if not dados:
-            return jsonify({'success': False, 'message': 'Sem dados para exportar'}), 400
+def preparar_exportacao(registros):
+    """Uma única passada pelos registros.
 
-        df_completo = pd.DataFrame(dados)
-        # remover colunas técnicas se existirem
-        colunas_remover = ['id', 'timestamp']
-        df_completo = df_completo.drop(columns=[c for c in colunas_remover if c in df_completo.columns])
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-        def sanitize_filename(name, max_len=100):
-            if not name:
-                name = "sem_nome"
-            name = str(name)
-            name = re.sub(r'[<>:"/\\|?*\n\r\t]', '_', name)
-            name = re.sub(r'[\. ]+$', '', name)
-            return name[:max_len]
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # planilha completa
-            excel_buffer = BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                df_completo.to_excel(writer, index=False, sheet_name='Produção')
-                ws = writer.sheets['Produção']
-
-                for idx, col in enumerate(df_completo.columns, 1):
-                    try:
-                        max_len = max(df_completo[col].astype(str).apply(len).max(), len(col)) + 2
-                    except Exception:
-                        max_len = len(col) + 2
-                    ws.column_dimensions[get_column_letter(idx)].width = min(max_len, 60)
-
-                for cell in ws[1]:
-                    cell.font = Font(bold=True, size=11, color="FFFFFF")
-                    cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-                    cell.alignment = Alignment(horizontal='center', vertical='center')
-
-            excel_buffer.seek(0)
-            zip_file.writestr(f'producao_completa_{timestamp}.xlsx', excel_buffer.read())
-
-            # por bordador
-            if 'Bordador' in df_completo.columns:
-                bordadores = df_completo['Bordador'].dropna().unique()
-            else:
-                bordadores = []
+    Retorna as colunas (na ordem em que aparecem), os registros agrupados por
+    bordador e o maior comprimento de cada coluna, para a planilha completa
+    (chave None) e para a de cada bordador.
+    """
+    colunas = {}
+    grupos = {}
+    larguras = {None: {}}
+    for registro in registros:
+        bordador = registro.get('Bordador')
+        alvos = [larguras[None]]
+        if bordador is not None:
+            grupos.setdefault(bordador, []).append(registro)
+            alvos.append(larguras.setdefault(bordador, {}))
+        for coluna, valor in registro.items():
+            if coluna in COLUNAS_TECNICAS:
+                continue
+            colunas.setdefault(coluna, None)
+            tamanho = len(str(valor)) if valor is not None else 0
+            for alvo in alvos:
+                if tamanho > alvo.get(coluna, 0):
+                    alvo[coluna] = tamanho
+    return list(colunas), grupos, larguras
+
+def escrever_planilha(destino, colunas, registros, larguras, cor):
+    """Grava a planilha em modo write-only (linha a linha) no arquivo `destino`."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Produção')
 
-            app.logger.info(f"[exportar] bordadores: {bordadores}")
+    for idx, coluna in enumerate(colunas, 1):
+        largura = max(larguras.get(coluna, 0), len(coluna)) + 2
+        ws.column_dimensions[get_column_letter(idx)].width = min(largura, 60)
 
-            for bordador in bordadores:
-                df_b = df_completo[df_completo['Bordador'] == bordador]
-                excel_buffer = BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                    df_b.to_excel(writer, index=False, sheet_name='Produção')
-                    ws = writer.sheets['Produção']
+    cabecalho = []
+    for coluna in colunas:
+        cell = WriteOnlyCell(ws, value=coluna)
+        cell.font = Font(bold=True, size=11, color="FFFFFF")
+        cell.fill = PatternFill(start_color=cor, end_color=cor, fill_type="solid")
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cabecalho.append(cell)
+    ws.append(cabecalho)
 
-                    for idx, col in enumerate(df_b.columns, 1):
-                        try:
-                            max_len = max(df_b[col].astype(str).apply(len).max(), len(col)) + 2
-                        except Exception:
-                            max_len = len(col) + 2
-                        ws.column_dimensions[get_column_letter(idx)].width = min(max_len, 60)
+    for registro in registros:
+        ws.append([registro.get(coluna) for coluna in colunas])
 
-                    for cell in ws[1]:
-                        cell.font = Font(bold=True, size=11, color="FFFFFF")
-                        cell.fill = PatternFill(start_color="10b981", end_color="10b981", fill_type="solid")
-                        cell.alignment = Alignment(horizontal='center', vertical='center')
+    wb.save(destino)
 
-                excel_buffer.seek(0)
-                filename = f"{sanitize_filename(bordador)}_{timestamp}.xlsx"
-                zip_file.writestr(filename, excel_buffer.read())
+def renderizar_planilha(colunas, registros, larguras, cor):
+    """Executada num processo do pool: grava a planilha num arquivo temporário e devolve o caminho."""
+    fd, caminho = tempfile.mkstemp(suffix='.xlsx')
+    with os.fdopen(fd, 'wb') as destino:
+        escrever_planilha(destino, colunas, registros, larguras, cor)
+    return caminho
 
-        # garantir ponteiro no início
-        zip_buffer.seek(0)
+_pool_exportacao = None
+_pool_lock = threading.Lock()
 
-        # tentar enviar em memória
-        try:
-            response = send_file(
-                zip_buffer,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name=f'producao_completa_{timestamp}.zip',
-                conditional=False,
-                max_age=0
+def pool_exportacao():
+    """Pool de processos compartilhado pelas exportações, criado no primeiro uso."""
+    global _pool_exportacao
+    with _pool_lock:
+        if _pool_exportacao is None:
+            # 'spawn': o worker tem threads (compactação do journal) e fork as copiaria no meio
+            _pool_exportacao = ProcessPoolExecutor(
+                max_workers=EXPORT_PROCESSOS,
+                mp_context=multiprocessing.get_context('spawn')
             )
-            # só limpar os dados se o send_file não levantar exceção
-            salvar_dados([])
-            app.logger.info("[exportar] dados limpos após exportação")
-            return response
+        return _pool_exportacao
+
+def gerar_exportacao(arquivo_zip, dados, timestamp, progresso=None):
+    """Gera o ZIP com a planilha completa e uma por bordador em `arquivo_zip`.
+
+    Com EXPORT_PROCESSOS > 1 as planilhas (openpyxl é CPU-bound) são
+    renderizadas em paralelo no pool e entram no ZIP à medida que ficam prontas.
+    `progresso(feitas, total)` é chamado a cada planilha concluída.
+    """
+    colunas, grupos, larguras = preparar_exportacao(dados)
+    app.logger.info(f"[exportar] bordadores: {list(grupos)}")
+
+    planilhas = [(f'producao_completa_{timestamp}.xlsx', dados, larguras[None], "4472C4")]
+    for bordador, registros in grupos.items():
+        filename = f"{sanitize_filename(bordador)}_{timestamp}.xlsx"
+        planilhas.append((filename, registros, larguras[bordador], "10b981"))
+
+    with zipfile.ZipFile(arquivo_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        if EXPORT_PROCESSOS <= 1:
+            # cada planilha é gravada direto na sua entrada do ZIP
+            for feitas, (filename, registros, larguras_planilha, cor) in enumerate(planilhas, 1):
+                with zip_file.open(filename, 'w') as destino:
+                    escrever_planilha(destino, colunas, registros, larguras_planilha, cor)
+                if progresso:
+                    progresso(feitas, len(planilhas))
+            return
+
+        pool = pool_exportacao()
+        futuros = {
+            pool.submit(renderizar_planilha, colunas, registros, larguras_planilha, cor): filename
+            for filename, registros, larguras_planilha, cor in planilhas
+        }
+        try:
+            for feitas, futuro in enumerate(as_completed(futuros), 1):
+                caminho = futuro.result()
+                try:
+                    zip_file.write(caminho, futuros[futuro])
+                finally:
+                    os.remove(caminho)
+                if progresso:
+                    progresso(feitas, len(planilhas))
+        except BrokenProcessPool:
+            # um processo morreu (OOM, kill): a próxima exportação cria um pool novo
+            global _pool_exportacao
+            with _pool_lock:
+                if _pool_exportacao is pool:
+                    _pool_exportacao = None
+            raise
+        finally:
+            # em caso de erro, não deixar arquivos temporários para trás
+            for futuro in futuros:
+                if not futuro.cancel() and futuro.done() and not futuro.exception():
+                    if os.path.exists(futuro.result()):
+                        os.remove(futuro.result())
+
+# Tarefas de exportação em segundo plano
+#
+# POST /api/exportar cria a tarefa e responde na hora; a geração roda numa
+# thread do worker. O estado de cada tarefa é um JSON em EXPORT_DIR (qualquer
+# worker do gunicorn consegue responder status e download) e o ZIP pronto
+# fica ao lado dele até ser removido pela retenção. Enquanto roda, a tarefa
+# regrava o JSON (`atualizado_em`) a cada EXPORT_HEARTBEAT_SEGUNDOS.
+_tarefas_lock = threading.Lock()
+_criacao_lock = threading.Lock()
+
+def _caminho_tarefa(job_id, extensao):
+    return os.path.join(EXPORT_DIR, f'{job_id}.{extensao}')
+
+@contextmanager
+def _exclusivo_exportacao():
+    """Lock (entre threads e, com fcntl, entre workers) para verificar se há
+    exportação em andamento e criar a tarefa sem outra no meio."""
+    with _criacao_lock, open(os.path.join(EXPORT_DIR, 'exportar.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+def carregar_tarefa(job_id):
+    if not re.fullmatch(r'[0-9a-f]{16}', job_id):
+        return None
+    try:
+        with open(_caminho_tarefa(job_id, 'json'), 'r', encoding='utf-8') as f:
+            tarefa = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    # o worker que rodava a tarefa morreu (restart, OOM) antes de terminar: o
+    # pid pode já ser de outro processo, então vale o último heartbeat
+    if tarefa['status'] in ('pendente', 'executando') and _tarefa_parada(tarefa):
+        tarefa.update(status='erro', mensagem='Exportação interrompida')
+        salvar_tarefa(tarefa)
+    return tarefa
+
+def salvar_tarefa(tarefa):
+    # o heartbeat e a thread da tarefa gravam o mesmo arquivo (e o mesmo .tmp)
+    with _tarefas_lock:
+        tarefa['atualizado_em'] = datetime.now().isoformat()
+        conteudo = json.dumps(tarefa, ensure_ascii=False)
+        gravar_arquivo_atomico(_caminho_tarefa(tarefa['job_id'], 'json'), conteudo)
+
+def _tarefa_parada(tarefa):
+    atualizado = datetime.fromisoformat(tarefa['atualizado_em']).timestamp()
+    return (datetime.now().timestamp() - atualizado > EXPORT_TAREFA_EXPIRA_SEGUNDOS
+            or not _processo_vivo(tarefa['pid']))
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _heartbeat_tarefa(tarefa, parar):
+    while not parar.wait(EXPORT_HEARTBEAT_SEGUNDOS):
+        try:
+            salvar_tarefa(tarefa)
+        except OSError as e:
+            app.logger.warning(f"[exportar] heartbeat da tarefa {tarefa['job_id']} falhou: {e}")
+
+def listar_tarefas():
+    tarefas = []
+    for nome in os.listdir(EXPORT_DIR):
+        if nome.endswith('.json'):
+            tarefa = carregar_tarefa(nome[:-len('.json')])
+            if tarefa:
+                tarefas.append(tarefa)
+    return sorted(tarefas, key=lambda t: t['criado_em'])
+
+def remover_tarefa(tarefa):
+    for extensao in ('zip', 'json'):
+        try:
+            os.remove(_caminho_tarefa(tarefa['job_id'], extensao))
+        except FileNotFoundError:
+            pass
+
+def aplicar_retencao_exportacoes():
+    """Remove tarefas terminadas mais antigas que a retenção e mantém no máximo EXPORT_MAX_ARQUIVOS ZIPs."""
+    limite = datetime.now().timestamp() - EXPORT_RETENCAO_HORAS * 3600
+    terminadas = [t for t in listar_tarefas() if t['status'] in ('concluido', 'erro')]
+    for posicao, tarefa in enumerate(reversed(terminadas)):
+        if posicao >= EXPORT_MAX_ARQUIVOS or datetime.fromisoformat(tarefa['atualizado_em']).timestamp() < limite:
+            remover_tarefa(tarefa)
 
-        except Exception as e_send:
-            # fallback: gravar arquivo temporário no disco e enviá-lo (menor chance de problemas)
-            app.logger.error("[exportar] erro ao enviar em memória, tentando fallback em disco: " + str(e_send))
-            traceback.print_exc()
-            temp_path = f"/tmp/producao_completa_{timestamp}.zip"
-            with open(temp_path, "wb") as f:
-                f.write(zip_buffer.getvalue())
-            # limpar dados
-            salvar_dados([])
-            app.logger.info("[exportar] dados limpos após exportação (fallback em disco)")
-            return send_file(temp_path, as_attachment=True, download_name=f'producao_completa_{timestamp}.zip')
+def executar_tarefa_exportacao(tarefa, dados):
+    """Gera o ZIP da tarefa; só depois de gravado e registrado como concluído arquiva os dados."""
+    caminho = _caminho_tarefa(tarefa['job_id'], 'zip')
+    temporario = caminho + '.tmp'
 
+    def progresso(feitas, total):
+        tarefa.update(progresso=feitas, total=total)
+        salvar_tarefa(tarefa)
+
+    parar = threading.Event()
+    threading.Thread(target=_heartbeat_tarefa, args=(tarefa, parar), daemon=True).start()
+    try:
+        tarefa['status'] = 'executando'
+        salvar_tarefa(tarefa)
+        with open(temporario, 'wb') as arquivo_zip:
+            gerar_exportacao(arquivo_zip, dados, tarefa['timestamp'], progresso)
+            arquivo_zip.flush()
+            os.fsync(arquivo_zip.fileno())
+        os.replace(temporario, caminho)
+        parar.set()
+        tarefa['status'] = 'concluido'
+        salvar_tarefa(tarefa)
     except Exception as e:
+        parar.set()
         app.logger.error("[exportar] erro: " + str(e))
         traceback.print_exc()
-        return jsonify({'success': False, 'message': 'Erro interno ao exportar', 'error': str(e)}), 500
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        tarefa.update(status='erro', mensagem=str(e))
+        salvar_tarefa(tarefa)
+        return
+
+    # só arquivar (e tirar do armazém) depois que o ZIP foi gravado e a tarefa concluída;
+    # `limpo` só se o arquivamento deu certo, senão o ZIP fica e o erro vai em `erro`
+    try:
+        removidos = armazem.remover_exportados(dados, arquivo_producao)
+        app.logger.info(f"[exportar] {removidos} registros arquivados após exportação")
+        tarefa['limpo'] = True
+    except Exception as e:
+        app.logger.error("[exportar] erro ao arquivar dados exportados: " + str(e))
+        tarefa.update(erro=str(e), mensagem='Planilhas geradas, mas os dados não foram arquivados')
+    salvar_tarefa(tarefa)
+
+@app.route('/api/exportar', methods=['POST'])
+def exportar_excel():
+    """Inicia a exportação em segundo plano e devolve o id da tarefa."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+
+    # duas exportações simultâneas arquivariam os mesmos dados: a verificação
+    # e a criação da tarefa acontecem sem outro worker no meio
+    with _exclusivo_exportacao():
+        aplicar_retencao_exportacoes()
+        for tarefa in listar_tarefas():
+            if tarefa['status'] in ('pendente', 'executando'):
+                return jsonify({
+                    'success': False,
+                    'message': 'Já existe uma exportação em andamento',
+                    'job_id': tarefa['job_id']
+                }), 409
+
+        dados = carregar_dados()
+        app.logger.info(f"[exportar] registros encontrados: {len(dados)}")
+
+        if not dados:
+            return jsonify({'success': False, 'message': 'Sem dados para exportar'}), 400
+
+        tarefa = {
+            'job_id': secrets.token_hex(8),
+            'status': 'pendente',
+            'progresso': 0,
+            'total': 0,
+            'registros': len(dados),
+            'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S'),
+            'criado_em': datetime.now().isoformat(),
+            'pid': os.getpid(),
+            'mensagem': '',
+            'limpo': False,
+            'erro': ''
+        }
+        salvar_tarefa(tarefa)
+    threading.Thread(target=executar_tarefa_exportacao, args=(dict(tarefa), dados), daemon=True).start()
+
+    return jsonify({'success': True, 'job_id': tarefa['job_id'], 'status': tarefa['status']}), 202
+
+@app.route('/api/exportar/<job_id>', methods=['GET'])
+def status_exportacao(job_id):
+    tarefa = carregar_tarefa(job_id)
+    if tarefa is None:
+        return jsonify({'success': False, 'message': 'Exportação não encontrada'}), 404
+    return jsonify({'success': True, **{k: v for k, v in tarefa.items() if k != 'pid'}})
+
+@app.route('/api/exportar/<job_id>/download', methods=['GET'])
+def download_exportacao(job_id):
+    tarefa = carregar_tarefa(job_id)
+    if tarefa is None or tarefa['status'] != 'concluido':
+        return jsonify({'success': False, 'message': 'Exportação não encontrada ou não concluída'}), 404
+    return send_file(
+        os.path.abspath(_caminho_tarefa(job_id, 'zip')),
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=f"producao_completa_{tarefa['timestamp']}.zip",
+        max_age=0
+    )
 
 
 
 
 # Rota de Estatísticas
 @app.route('/api/estatisticas', methods=['GET'])
+@resposta_condicional
 def get_estatisticas():
-    dados = carregar_dados()
     bordador = request.args.get('bordador')
     
-    if bordador:
-        dados = [d for d in dados if d.get('Bordador') == bordador]
+    # Calcular totais
+    return jsonify(armazem.estatisticas(bordador=bordador))
+
+
+@app.route('/api/estatisticas/serie', methods=['GET'])
+@resposta_condicional
+def get_estatisticas_serie():
+    """Peças e pontos por dia, semana ou mês, no total e por bordador (para gráficos)"""
+    granularidade = request.args.get('granularidade', 'dia')
+    if granularidade not in ('dia', 'semana', 'mes'):
+        return jsonify({'success': False, 'message': 'Granularidade inválida (use dia, semana ou mes)'}), 400
     
-    total_registros = len(dados)
+    try:
+        serie = armazem.serie(
+            granularidade,
+            bordador=request.args.get('bordador'),
+            data_inicio=request.args.get('data_inicio'),
+            data_fim=request.args.get('data_fim'),
+            arquivados=arquivo_producao.celulas(
+                request.args.get('bordador'), request.args.get('data_inicio'), request.args.get('data_fim')
+            )
+        )
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Datas inválidas'}), 400
     
-    # Calcular totais
-    total_pecas = 0
-    total_pontos = 0
+    return jsonify({'success': True, 'granularidade': granularidade, **serie})
+
+
+def intervalo_periodo(periodo):
+    """(data_inicio, data_fim) de um 'AAAA', 'AAAA-MM' ou 'AAAA-MM-DD'; ValueError se inválido."""
+    if re.fullmatch(r'\d{4}', periodo):
+        return f'{periodo}-01-01', f'{periodo}-12-31'
+    if re.fullmatch(r'\d{4}-\d{2}', periodo):
+        ano, mes = map(int, periodo.split('-'))
+        inicio = date(ano, mes, 1)
+        fim = date(ano + mes // 12, mes % 12 + 1, 1).toordinal() - 1
+        return inicio.isoformat(), date.fromordinal(fim).isoformat()
+    dia = date.fromisoformat(periodo).isoformat()
+    return dia, dia
+
+
+@app.route('/api/ranking', methods=['GET'])
+@resposta_condicional
+def get_ranking():
+    """Os `k` bordadores com mais pontos (ou peças, com `por=pecas`) no período.
+
+    O período é `periodo` (AAAA, AAAA-MM ou AAAA-MM-DD) ou `data_inicio` e
+    `data_fim`; sem nenhum dos dois, toda a produção.
+    """
+    criterio = request.args.get('por', 'pontos')
+    if criterio not in ('pontos', 'pecas', 'registros'):
+        return jsonify({'success': False, 'message': 'Critério inválido (use pontos, pecas ou registros)'}), 400
     
-    for d in dados:
-        try:
-            qtd = int(''.join(filter(str.isdigit, str(d.get('QTD', '0')))))
-            total_pecas += qtd
-        except:
-            pass
-        
-        try:
-            pontos = int(''.join(filter(str.isdigit, str(d.get('PONTOS', '0')))))
-            total_pontos += pontos
-        except:
-            pass
+    try:
+        k = int(request.args.get('k', RANKING_PADRAO))
+        if k <= 0:
+            raise ValueError('k deve ser positivo')
+        periodo = request.args.get('periodo')
+        if periodo:
+            data_inicio, data_fim = intervalo_periodo(periodo)
+        else:
+            data_inicio, data_fim = request.args.get('data_inicio'), request.args.get('data_fim')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Parâmetros do ranking inválidos'}), 400
     
     return jsonify({
-        'total_registros': total_registros,
-        'total_pecas': total_pecas,
-        'total_pontos': total_pontos
+        'success': True,
+        'por': criterio,
+        'data_inicio': data_inicio if data_inicio and data_fim else None,
+        'data_fim': data_fim if data_inicio and data_fim else None,
+        'ranking': armazem.ranking(k, criterio, data_inicio, data_fim,
+                                   arquivados=arquivo_producao.por_bordador(data_inicio, data_fim))
     })
 
 
+def consultar_arquivados(com, sem, bordador, data_inicio, data_fim, pedido):
+    """Registros arquivados que passam nos mesmos filtros de /api/producao/consulta."""
+    return [
+        r for r in arquivo_producao.filtrar(bordador, data_inicio, data_fim, pedido)
+        if all(r.get(campo) == 'X' for campo in com)
+        and not any(r.get(campo) == 'X' for campo in sem)
+    ]
+
+
+@app.route('/api/producao/consulta', methods=['GET'])
+@resposta_condicional
+def consultar_producao():
+    """Totais da produção com qualquer combinação de marcas, bordador, período e pedido.
+
+    `marcas` (separadas por vírgula: BONE, CUMBUCA, VISEIRA, BORDADO, AP_PINT,
+    AP_GRAV, FRENTE, LATERAL, TRASEIRA) são exigidas e `sem` excluídas. O
+    período é `periodo` (AAAA, AAAA-MM ou AAAA-MM-DD) ou `data_inicio` e
+    `data_fim`. Com ou sem período, inclui o histórico arquivado. Os
+    registros só vêm com `registros=1`, paginados por `limit` e `cursor`.
+    """
+    try:
+        com, sem = (
+            [campo.strip().upper() for campo in request.args.get(nome, '').split(',') if campo.strip()]
+            for nome in ('marcas', 'sem')
+        )
+        invalidas = [campo for campo in com + sem if campo not in RegistroCompacto.MARCAS]
+        if invalidas:
+            return jsonify({'success': False, 'message': f"Marcas inválidas: {', '.join(invalidas)}"}), 400
+        periodo = request.args.get('periodo')
+        if periodo:
+            data_inicio, data_fim = intervalo_periodo(periodo)
+        else:
+            data_inicio, data_fim = request.args.get('data_inicio'), request.args.get('data_fim')
+        limite, cursor = parametros_paginacao(request.args)
+        bordador, pedido = request.args.get('bordador'), request.args.get('pedido')
+        com_registros = request.args.get('registros') in ('1', 'true')
+        totais, dados, proximo = armazem.consulta(
+            com, sem, bordador, data_inicio, data_fim, pedido,
+            registros=com_registros, apos=cursor, limite=limite
+        )
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Parâmetros da consulta inválidos'}), 400
+    
+    arquivados = consultar_arquivados(com, sem, bordador, data_inicio, data_fim, pedido)
+    if com_registros:
+        dados, totais['total_registros'], proximo = juntar_arquivados(
+            dados, totais['total_registros'], proximo, arquivados, cursor, limite
+        )
+    else:
+        totais['total_registros'] += len(arquivados)
+    for registro in arquivados:
+        totais['total_pecas'] += numero_inteiro(registro.get('QTD', '0'))
+        totais['total_pontos'] += numero_inteiro(registro.get('PONTOS', '0'))
+        for campo in RegistroCompacto.MARCAS:
+            totais['marcas'][campo] += registro.get(campo) == 'X'
+    
+    resposta = {
+        'success': True,
+        'data_inicio': data_inicio if data_inicio and data_fim else None,
+        'data_fim': data_fim if data_inicio and data_fim else None,
+        **totais
+    }
+    if com_registros:
+        resposta['registros'] = dados
+        resposta['proximo_cursor'] = proximo
+    return jsonify(resposta)
+
+
 @app.route('/api/buscar-pedido/<pedido_id>', methods=['GET'])
+@resposta_condicional
 def buscar_pedido(pedido_id):
-    """Busca todos os registros de um pedido específico e agrupa por bordador e posição"""
-    dados = carregar_dados()
+    """Busca o resumo de um pedido: registros agrupados por bordador, posição, tipo e processo"""
+    # O resumo é mantido pelo armazém a cada gravação; um pedido com registros
+    # arquivados é remontado junto com eles
+    resultado = armazem.resumo_pedido(pedido_id, arquivados=arquivo_producao.por_pedido(pedido_id))
     
-    # Filtrar registros pelo ID do pedido
-    registros = [d for d in dados if d.get('ID') == pedido_id]
-    
-    if not registros:
+    if resultado is None:
         return jsonify({
             'success': False,
             'message': 'Nenhum registro encontrado para este ID'
         }), 404
     
-    # Organizar informações por posição
-    resultado = {
-        'id_pedido': pedido_id,
-        'total_registros': len(registros),
-        'bordadores': {},
-        'posicoes': {
-            'FRENTE': [],
-            'LATERAL': [],
-            'TRASEIRA': []
-        },
-        'tipos': {
-            'BONE': [],
-            'CUMBUCA': [],
-            'VISEIRA': []
-        },
-        'processos': {
-            'BORDADO': [],
-            'AP_PINT': [],
-            'AP_GRAV': []
-        },
-        'resumo': {
-            'total_pecas': 0,
-            'total_pontos': 0
-        }
-    }
-    
-    # Processar cada registro
-    for registro in registros:
-        bordador = registro.get('Bordador', 'Desconhecido')
-        
-        # Inicializar bordador se não existe
-        if bordador not in resultado['bordadores']:
-            resultado['bordadores'][bordador] = {
-                'registros': 0,
-                'pecas': 0,
-                'pontos': 0,
-                'posicoes': [],
-                'data': registro.get('Data', '')
-            }
-        
-        # Contar registros e somar totais
-        resultado['bordadores'][bordador]['registros'] += 1
-        
-        try:
-            qtd = int(''.join(filter(str.isdigit, str(registro.get('QTD', '0')))))
-            resultado['bordadores'][bordador]['pecas'] += qtd
-            resultado['resumo']['total_pecas'] += qtd
-        except:
-            pass
-        
-        try:
-            pontos = int(''.join(filter(str.isdigit, str(registro.get('PONTOS', '0')))))
-            resultado['bordadores'][bordador]['pontos'] += pontos
-            resultado['resumo']['total_pontos'] += pontos
-        except:
-            pass
-        
-        # Verificar posições
-        if registro.get('FRENTE') == 'X':
-            resultado['posicoes']['FRENTE'].append({
-                'bordador': bordador,
-                'qtd': registro.get('QTD', '0'),
-                'pontos': registro.get('PONTOS', '0'),
-                'data': registro.get('Data', ''),
-                'bordado': registro.get('BORDADO', '') == 'X'
-            })
-            if 'Frente' not in resultado['bordadores'][bordador]['posicoes']:
-                resultado['bordadores'][bordador]['posicoes'].append('Frente')
-        
-        if registro.get('LATERAL') == 'X':
-            resultado['posicoes']['LATERAL'].append({
-                'bordador': bordador,
-                'qtd': registro.get('QTD', '0'),
-                'pontos': registro.get('PONTOS', '0'),
-                'data': registro.get('Data', ''),
-                'bordado': registro.get('BORDADO', '') == 'X'
-            })
-            if 'Lateral' not in resultado['bordadores'][bordador]['posicoes']:
-                resultado['bordadores'][bordador]['posicoes'].append('Lateral')
-        
-        if registro.get('TRASEIRA') == 'X':
-            resultado['posicoes']['TRASEIRA'].append({
-                'bordador': bordador,
-                'qtd': registro.get('QTD', '0'),
-                'pontos': registro.get('PONTOS', '0'),
-                'data': registro.get('Data', ''),
-                'bordado': registro.get('BORDADO', '') == 'X'
-            })
-            if 'Traseira' not in resultado['bordadores'][bordador]['posicoes']:
-                resultado['bordadores'][bordador]['posicoes'].append('Traseira')
-        
-        # Verificar tipos
-        if registro.get('BONE') == 'X':
-            if bordador not in [t['bordador'] for t in resultado['tipos']['BONE']]:
-                resultado['tipos']['BONE'].append({'bordador': bordador})
-        
-        if registro.get('CUMBUCA') == 'X':
-            if bordador not in [t['bordador'] for t in resultado['tipos']['CUMBUCA']]:
-                resultado['tipos']['CUMBUCA'].append({'bordador': bordador})
-        
-        if registro.get('VISEIRA') == 'X':
-            if bordador not in [t['bordador'] for t in resultado['tipos']['VISEIRA']]:
-                resultado['tipos']['VISEIRA'].append({'bordador': bordador})
-        
-        # Verificar processos
-        if registro.get('BORDADO') == 'X':
-            if bordador not in [p['bordador'] for p in resultado['processos']['BORDADO']]:
-                resultado['processos']['BORDADO'].append({'bordador': bordador})
-        
-        if registro.get('AP_PINT') == 'X':
-            if bordador not in [p['bordador'] for p in resultado['processos']['AP_PINT']]:
-                resultado['processos']['AP_PINT'].append({'bordador': bordador})
-        
-        if registro.get('AP_GRAV') == 'X':
-            if bordador not in [p['bordador'] for p in resultado['processos']['AP_GRAV']]:
-                resultado['processos']['AP_GRAV'].append({'bordador': bordador})
-    
     return jsonify({
         'success': True,
         'resultado': resultado
     })
 
-# Adicionar a primeira produção e criar uma lista de dados de produção automatica 
-def caminho_producao_diaria():
-    """Retorna o caminho do arquivo da produção do dia."""
-    hoje = date.today().strftime("%Y-%m-%d")
-    return f"dados_producao_{hoje}.json"
-
-def carregar_producao():
-    """Carrega o arquivo de produção do dia, criando se não existir."""
-    caminho = caminho_producao_diaria()
-    if not os.path.exists(caminho):
-        with open(caminho, "w", encoding="utf-8") as f:
-            json.dump([], f, indent=4, ensure_ascii=False)
-        return []
-    with open(caminho, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
-
-def salvar_producao(dados):
-    """Salva as produções do dia no arquivo correto."""
-    caminho = caminho_producao_diaria()
-    with open(caminho, "w", encoding="utf-8") as f:
-        json.dump(dados, f, indent=4, ensure_ascii=False)
-
+@app.route('/api/pedidos/sugerir', methods=['GET'])
+@resposta_condicional
+def sugerir_pedidos():
+    """Pedidos cujo ID (ou FOLHA) começa com `q`, para o autocompletar da pesquisa"""
+    texto = request.args.get('q', '')
+    try:
+        limite = min(int(request.args.get('limite', SUGESTOES_PADRAO)), SUGESTOES_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Parâmetro limite inválido'}), 400
+    
+    return jsonify({
+        'success': True,
+        'sugestoes': armazem.sugerir_pedidos(texto, max(limite, 0), arquivados=arquivo_producao.prefixos())
+    })
 
 # Rota para Gerente adicionar usuários
 @app.route('/api/usuarios', methods=['POST'])
+@somente_gerente
 def add_usuario():
     data = request.json
     usuarios = carregar_usuarios()
@@ -667,6 +4224,8 @@ def add_usuario():
 
 # Rota para listar todos os usuários
 @app.route('/api/usuarios', methods=['GET'])
+@somente_gerente
+@resposta_condicional
 def get_usuarios():
     usuarios = carregar_usuarios()
     # Remover senhas antes de enviar
@@ -680,6 +4239,7 @@ def get_usuarios():
 
 # Rota para atualizar usuário (já existe POST, agora adicionar PUT)
 @app.route('/api/usuarios/<username>', methods=['PUT'])
+@somente_gerente
 def update_usuario(username):
     data = request.json
     usuarios = carregar_usuarios()
@@ -701,11 +4261,7 @@ def update_usuario(username):
                 salvar_bordadores(bordadores)
             
             # Atualizar nos registros de produção
-            dados = carregar_dados()
-            for registro in dados:
-                if registro.get('Bordador') == old_name:
-                    registro['Bordador'] = data['nome']
-            salvar_dados(dados)
+            armazem.renomear_bordador(old_name, data['nome'], arquivo_producao)
     
     if 'senha' in data and data['senha']:
         from werkzeug.security import generate_password_hash
@@ -727,6 +4283,7 @@ def update_usuario(username):
 
 # Rota para excluir usuário
 @app.route('/api/usuarios/<username>', methods=['DELETE'])
+@somente_gerente
 def delete_usuario(username):
     usuarios = carregar_usuarios()
     
@@ -762,6 +4319,10 @@ def delete_usuario(username):
 # Rota para alterar senha
 @app.route('/api/usuarios/<username>/senha', methods=['PUT'])
 def change_password(username):
+    # o gerente altera qualquer senha; os demais, só a própria
+    if g.usuario['tipo'] != 'gerente' and g.usuario['username'] != username:
+        return jsonify({'success': False, 'message': 'Acesso restrito ao gerente'}), 403
+    
     data = request.json
     usuarios = carregar_usuarios()
     
@@ -0,0 +1,94 @@
+"""Compara tamanho e tempo da serialização JSON antes e depois do orjson/gzip.
+
+Uso: python benchmark_json.py [quantidade_de_registros]
+
+"antes" é o json da biblioteca padrão como era usado (snapshot com indent=2,
+respostas do jsonify com chaves ordenadas e ensure_ascii); "depois" são as
+funções do app.py (orjson quando instalado, snapshot compacto, gzip).
+Roda num diretório temporário para não tocar nos dados reais.
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+
+def gerar_registros(quantidade):
+    bordadores = ['Joao Carlos Silva dos Reis', 'Igor Ederson', 'Silvanaldo dos Santos', 'Moisés Moura']
+    aleatorio = random.Random(42)
+    registros = []
+    for i in range(1, quantidade + 1):
+        registros.append({
+            'id': i,
+            'timestamp': f'2025-10-{aleatorio.randint(1, 28):02d}T14:{aleatorio.randint(0, 59):02d}:31.581386',
+            'Data': f'2025-{aleatorio.randint(1, 12):02d}-{aleatorio.randint(1, 28):02d}',
+            'Bordador': aleatorio.choice(bordadores),
+            'ID': str(aleatorio.randint(100000, 999999)),
+            'FOLHA': f'{aleatorio.randint(1, 9)}-{aleatorio.randint(1, 9)}',
+            'QTD': str(aleatorio.randint(1, 200)),
+            'BONE': aleatorio.choice(['X', '']),
+            'CUMBUCA': aleatorio.choice(['X', '']),
+            'VISEIRA': '',
+            'BORDADO': 'X',
+            'AP_PINT': '',
+            'AP_GRAV': '',
+            'FRENTE': aleatorio.choice(['X', '']),
+            'LATERAL': aleatorio.choice(['X', '']),
+            'TRASEIRA': '',
+            'PONTOS': str(aleatorio.randint(1000, 90000)),
+        })
+    return registros
+
+
+def medir(funcao, repeticoes=5):
+    """Melhor tempo (ms) entre as repetições e o resultado da última."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        decorrido = (time.perf_counter() - inicio) * 1000
+        melhor = decorrido if melhor is None else min(melhor, decorrido)
+    return melhor, resultado
+
+
+def linha(nome, ms, tamanho):
+    print(f'  {nome:<28} {ms:9.1f} ms {tamanho / 1024:11.1f} KiB')
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    os.chdir(tempfile.mkdtemp(prefix='benchmark_json_'))
+    sys.path.insert(0, RAIZ)
+    import app
+
+    registros = gerar_registros(quantidade)
+    nomes = {1: 'Silvanaldo dos Santos', 2: 'Igor Ederson'}
+    print(f'{quantidade} registros, orjson {"instalado" if app.orjson is not None else "ausente"}\n')
+
+    print('Snapshot em disco')
+    ms, antes = medir(lambda: json.dumps({'bordadores': nomes, 'registros': registros},
+                                         ensure_ascii=False, indent=2).encode('utf-8'))
+    linha('antes (indent=2)', ms, len(antes))
+    ms, depois = medir(lambda: app.ArmazemJSON._serializar(registros, nomes, quantidade))
+    linha('depois (compacto)', ms, len(depois))
+    ms, _ = medir(lambda: json.loads(antes))
+    linha('leitura antes', ms, len(antes))
+    ms, _ = medir(lambda: app.json_ler(depois))
+    linha('leitura depois', ms, len(depois))
+
+    print('\nResposta de /api/producao')
+    ms, antes = medir(lambda: json.dumps(registros, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    linha('antes (jsonify padrão)', ms, len(antes))
+    ms, depois = medir(lambda: app.json_bytes(registros))
+    linha('depois (serializador)', ms, len(depois))
+    ms, comprimido = medir(lambda: gzip.compress(app.json_bytes(registros), app.GZIP_NIVEL))
+    linha(f'depois + gzip nível {app.GZIP_NIVEL}', ms, len(comprimido))
+
+
+if __name__ == '__main__':
+    main()